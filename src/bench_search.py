@@ -0,0 +1,93 @@
+"""
+Micro-benchmark dell'indice di ricerca usato dall'autocomplete (cogs.core.search),
+confrontato con la scansione lineare che c'era prima.
+
+Uso:
+    python src/bench_search.py --sizes 10000 100000 [--used 0.5]
+"""
+
+import argparse
+import random
+import string
+import time
+
+from cogs.core.search import SearchIndex
+
+WORDS = ["bruh", "moment", "airhorn", "applause", "big", "bob", "sad", "violin",
+         "laugh", "track", "wow", "oof", "drum", "roll", "vine", "boom", "nope", "yes"]
+SYLLABLES = ["ka", "ro", "mi", "zu", "te", "la", "bo", "ni", "sha", "ve", "gu", "pe", "dra", "lo"]
+QUERIES = {
+    "vuota": "",
+    "prefisso": "air",
+    "parola": "violin",
+    "fuzzy": "aplause",
+}
+
+
+def random_word(rng: random.Random) -> str:
+    # Vocabolario misto: poche parole frequenti e molte parole "inventate"
+    if rng.random() < 0.3:
+        return rng.choice(WORDS)
+    return "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+
+
+def random_name(rng: random.Random) -> str:
+    words = [random_word(rng) for _ in range(rng.randint(1, 3))]
+    suffix = "".join(rng.choices(string.ascii_lowercase + string.digits, k=4))
+    return "_".join(words) + f"_{suffix}"
+
+
+def linear_scan(entries: dict, query: str) -> list:
+    return [(name, value) for name, value in entries.items()
+            if query.lower() in name.lower()][:25]
+
+
+def timed(fn, runs: int) -> float:
+    """Tempo medio in microsecondi (dopo un giro a vuoto)."""
+    fn()
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) / runs * 1e6
+
+
+def bench(size: int, runs: int, used: float, rng: random.Random) -> None:
+    entries = {}
+    while len(entries) < size:
+        entries[random_name(rng)] = f"{len(entries)}.wav"
+
+    started = time.perf_counter()
+    index = SearchIndex(entries)
+    build_ms = (time.perf_counter() - started) * 1000
+    # Una parte delle voci già usata almeno una volta, come su un server attivo
+    for name in rng.sample(list(entries), int(size * used)):
+        index.set_usage(name, rng.randint(1, 100), time.time() - rng.random() * 86400)
+    print(f"\n== {size} voci, {used:.0%} usate (build {build_ms:.0f} ms) ==")
+
+    for label, query in QUERIES.items():
+        indexed = timed(lambda: index.search(query), runs)
+        scan = timed(lambda: linear_scan(entries, query), runs)
+        print(f"{label:>9}: indice {indexed:8.1f} µs | scansione {scan:8.1f} µs")
+
+    names = [random_name(rng) for _ in range(runs + 1)]
+    add = timed(lambda: index.add(names.pop(), "new.wav"), runs)
+    victims = rng.sample(list(entries), runs + 1)
+    remove = timed(lambda: index.remove(victims.pop()), runs)
+    print(f"incrementale: add {add:.1f} µs | remove {remove:.1f} µs")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--used", type=float, default=0.5, help="quota di voci già usate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for size in args.sizes:
+        bench(size, args.runs, args.used, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark TTS su CPU: real-time factor (RTF) del percorso standard
+contro la modalità CPU ottimizzata (cogs.TTS.cpu_mode).
+
+RTF = secondi di calcolo / secondi di audio generato (più basso è meglio).
+
+Uso:
+    python src/bench_tts.py --speaker src/cogs/data/<guild>/speakers/voce.wav
+"""
+
+import argparse
+import os
+import time
+
+import torch
+from chatterbox.mtl_tts import ChatterboxMultilingualTTS
+
+from cogs.TTS.cpu_mode import CPUSettings, configure_threads, inference_context, optimize_model
+
+TEXTS = [
+    "Ciao a tutti, benvenuti nel server.",
+    "Oggi proviamo quanto è veloce la sintesi vocale sul processore.",
+    "Questa è una frase un po' più lunga, con qualche virgola, per misurare bene il tempo.",
+]
+
+
+def measure(model, settings: CPUSettings, speaker: str, language: str, runs: int) -> float:
+    with inference_context(settings):
+        model.prepare_conditionals(speaker)
+        # Primo giro a vuoto: allocator e kernel a regime
+        model.generate(TEXTS[0], language_id=language)
+
+        compute, audio = 0.0, 0.0
+        for _ in range(runs):
+            for text in TEXTS:
+                started = time.perf_counter()
+                wav = model.generate(text, language_id=language)
+                compute += time.perf_counter() - started
+                audio += wav.shape[-1] / model.sr
+    return compute / audio
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--speaker", required=True, help="WAV di riferimento")
+    parser.add_argument("--lang", default="it")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    baseline = CPUSettings(enabled=False, threads=torch.get_num_threads(),
+                           quantize=False, compile_modules=False)
+    fast = CPUSettings.from_env()
+    fast.enabled = True
+
+    print(f"Baseline: {torch.get_num_threads()} thread, fp32")
+    model = ChatterboxMultilingualTTS.from_pretrained(device="cpu")
+    rtf_base = measure(model, baseline, args.speaker, args.lang, args.runs)
+    del model
+
+    print(f"CPU mode: {fast.describe()}")
+    configure_threads(fast)
+    model = ChatterboxMultilingualTTS.from_pretrained(device="cpu")
+    applied = optimize_model(model, fast)
+    rtf_fast = measure(model, fast, args.speaker, args.lang, args.runs)
+
+    print()
+    print(f"{'percorso':<12}{'RTF':>8}")
+    print(f"{'baseline':<12}{rtf_base:>8.3f}")
+    print(f"{'cpu-fast':<12}{rtf_fast:>8.3f}   ({', '.join(applied) or 'solo thread'})")
+    print(f"speedup: {rtf_base / rtf_fast:.2f}x  (core disponibili: {os.cpu_count()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
+import asyncio
 import discord
-import wave
 import uuid
 import os
 from pathlib import Path
 from discord.ext import commands
 from discord import app_commands
 from discord.ext import voice_recv
-import json
-from cogs import get_guild_dir, get_guild_json
+from cogs import get_guild_dir
+from cogs.audio.ogg import OggOpusWriter
+from cogs.audio.wav_writer import BufferedWavWriter
+from cogs.core import store
+from cogs.TTS import reference
 import logging
 
 # Silenzia i log di info della libreria voice_recv
@@ -19,16 +22,14 @@ CURRDIR = Path(__file__).parent.absolute()
 class UserSpecificSink(voice_recv.AudioSink):
     """
     Sink audio che registra solo un utente specifico in formato WAV.
-    Gestisce la chiusura sicura per evitare errori di scrittura su file chiusi.
+    Il thread di ricezione copia solo i pacchetti in un buffer: conversione
+    (mono, sample rate del TTS) e scrittura su disco avvengono nel thread del writer.
     """
 
     def __init__(self, filename: str, target_user: discord.User):
         self.filename = filename
         self.target_user = target_user
-        self.file = wave.open(filename, "wb")
-        self.file.setnchannels(2)
-        self.file.setsampwidth(2)
-        self.file.setframerate(48000)
+        self.writer = BufferedWavWriter(filename)
         self._closed = False  # Flag per tracciare lo stato del file
 
     def wants_opus(self) -> bool:
@@ -39,32 +40,106 @@ class UserSpecificSink(voice_recv.AudioSink):
         if self._closed:
             return
 
-        try:
-            # Scrive solo se l'audio proviene dall'utente target
-            if user == self.target_user:
-                self.file.writeframes(data.pcm)
-        except (ValueError, AttributeError, OSError):
-            # Se il file viene chiuso mentre stiamo scrivendo, gestiamo l'errore silenziosamente
-            pass
+        # Scrive solo se l'audio proviene dall'utente target
+        if user != self.target_user:
+            return
+        if data.pcm:
+            self.writer.push(data.pcm)
+        elif data.opus:
+            # Sessione condivisa in modalità Opus: la decodifica la fa il thread del writer
+            self.writer.push_opus(data.opus, getattr(data.packet, "sequence", None))
 
     def cleanup(self):
         if not self._closed:
             self._closed = True
-            try:
-                self.file.close()
-            except Exception as e:
-                print(f"Errore durante la chiusura del file: {e}")
+            # Non blocca il thread di ricezione: il writer svuota il buffer e chiude
+            self.writer.close()
+
+class OpusSink(voice_recv.AudioSink):
+    """
+    Sink che salva i pacchetti Opus dell'utente così come arrivano, in un file Ogg.
+    Nessuna decodifica durante la registrazione: il TTS decodifica il file una
+    volta sola, al primo utilizzo dello speaker.
+    """
+
+    def __init__(self, filename: str, target_user: discord.User):
+        self.filename = filename
+        self.target_user = target_user
+        self.writer = OggOpusWriter(filename)
+        self._closed = False
+
+    def wants_opus(self) -> bool:
+        return True
+
+    def write(self, user, data):
+        if self._closed:
+            return
+
+        if user == self.target_user and data.opus:
+            self.writer.push(data.opus)
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            self.writer.close()
+
+class MultiUserSink(voice_recv.AudioSink):
+    """
+    Sink di sessione: smista i pacchetti alla traccia (UserSpecificSink o
+    OpusSink) dell'utente che parla. Ogni traccia ha il proprio buffer e il
+    proprio writer, e si avvia o si ferma senza toccare le altre.
+    Il formato dei pacchetti (Opus o PCM) è quello della prima traccia.
+    """
+
+    def __init__(self, opus: bool):
+        self.opus = opus
+        # Sostituito per intero a ogni modifica: il thread di ricezione legge
+        # sempre un dizionario completo, senza lock
+        self.tracks: dict[int, UserSpecificSink | OpusSink] = {}
+        self.closed = False
+
+    def wants_opus(self) -> bool:
+        return self.opus
+
+    def add(self, track: UserSpecificSink | OpusSink) -> None:
+        self.tracks = {**self.tracks, track.target_user.id: track}
+
+    def remove(self, user_id: int) -> UserSpecificSink | OpusSink | None:
+        tracks = dict(self.tracks)
+        track = tracks.pop(user_id, None)
+        self.tracks = tracks
+        if track is not None:
+            track.cleanup()
+        return track
+
+    def write(self, user, data):
+        if user is None:
+            return
+        track = self.tracks.get(user.id)
+        if track is not None:
+            track.write(user, data)
+
+    def cleanup(self):
+        self.closed = True
+        tracks, self.tracks = self.tracks, {}
+        for track in tracks.values():
+            track.cleanup()
+
 
 # Embedding RecordView
 class RecorderView(discord.ui.View):
     """
-    View che contiene il pulsante per fermare la registrazione.
+    View che contiene il pulsante per fermare la registrazione di un utente.
+    La sessione vocale si chiude quando si ferma l'ultima traccia.
     """
 
-    def __init__(self, vc: voice_recv.VoiceRecvClient, filename: str):
+    def __init__(self, vc: voice_recv.VoiceRecvClient, filename: str,
+                 session: MultiUserSink, sink: UserSpecificSink | OpusSink):
         super().__init__(timeout=None)
         self.vc = vc
         self.filename = filename
+        self.session = session
+        self.sink = sink
 
     @discord.ui.button(label="Interrompi Registrazione", style=discord.ButtonStyle.danger, emoji="⏹️")
     async def stop_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -76,11 +151,25 @@ class RecorderView(discord.ui.View):
         # Usa response.edit_message invece di defer+edit per stabilità sugli ephemeral
         await interaction.response.edit_message(view=self)
 
-        # 2. Esegui le operazioni logiche
-        if self.vc.is_listening():
-            self.vc.stop_listening()
-
-        await self.vc.disconnect()
+        # 2. Ferma solo questa traccia; l'ultima chiude la sessione
+        self.session.remove(self.sink.target_user.id)
+        if not self.session.tracks:
+            if self.vc.is_listening():
+                self.vc.stop_listening()
+            await self.vc.disconnect()
+
+        # Attende che il writer abbia scritto gli ultimi blocchi
+        await asyncio.to_thread(self.sink.writer.join, 10)
+        if isinstance(self.sink, UserSpecificSink):
+            stats = self.sink.writer.stats()
+            if stats["dropped"] or stats["late"]:
+                print(f"Registrazione {self.filename}: {stats}")
+            # Clip di riferimento per il TTS: silenzi tagliati e solo il parlato migliore.
+            # Le registrazioni Opus lo ottengono al primo uso, insieme alla decodifica.
+            try:
+                await asyncio.to_thread(reference.prepare, Path(self.filename))
+            except Exception as e:
+                print(f"Errore creazione clip di riferimento ({self.filename}): {e}")
 
         # 3. Invia messaggio di conferma finale
         # Nota: Usiamo followup perché abbiamo già risposto all'interazione con edit_message
@@ -94,50 +183,26 @@ class RecorderView(discord.ui.View):
 class Create_Speaker(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Sessione di registrazione attiva per guild
+        self.sessions: dict[int, MultiUserSink] = {}
         print("✅ Create_Speaker caricato...")
 
 
     async def save_speaker(self, interaction : discord.Interaction, speaker_name : str, speaker_filename : str) :
-        SPEAKERSJSON = await get_guild_json(interaction.guild_id, "speakers")
-        ALIASJSON = await get_guild_json(interaction.guild_id, "speakers", json_name="alias.json")
-        with open(SPEAKERSJSON, "r", encoding="utf-8") as f:
-            speakers = json.load(f)
-        with open(ALIASJSON, "r", encoding="utf-8") as f:
-            speaker_aliases = json.load(f)
-            for original, alias in speaker_aliases.items() :
-                if original == speaker_name :
-                    speaker_name = alias
-
-        speakers[speaker_name] = speaker_filename
-
-        with open(SPEAKERSJSON, "w", encoding="utf-8") as f:
-            json.dump(speakers, f, indent=4)
-
-    async def get_speaker_name(self, filename) -> str :
-        SPEAKERSJSON = await get_guild_json(interaction.guild_id, "speakers")
-
-        with open(SPEAKERSJSON, "r", encoding="utf-8") as f:
-            current_speakers = json.load(f)
-        speaker_found = ""
-        for speaker, value in current_speakers.items() :
-            if value == filename :
-                speaker_found = speaker
-        return speaker_found
+        # Se lo speaker era stato rinominato, usa il nome nuovo
+        speaker_name = await store.resolve_alias(interaction.guild_id, "speakers", speaker_name)
+        await store.add(interaction.guild_id, "speakers", speaker_name, speaker_filename)
+
+    async def get_speaker_name(self, interaction : discord.Interaction, filename) -> str :
+        return await store.lookup_name(interaction.guild_id, "speakers", filename) or ""
 
     async def autocomplete_speakers(
             self,
             interaction : discord.Interaction,
             current : str,
     ) -> list[app_commands.Choice[str]]:
-        SPEAKERSJSON = await get_guild_json(interaction.guild_id, "speakers")
-
-
-        with open(SPEAKERSJSON, "r", encoding="utf-8") as f:
-            current_speakers = json.load(f)
-
-        return [app_commands.Choice(name=name, value=filename)
-            for name, filename in current_speakers.items()
-            if current.lower() in name.lower()][:25]
+        matches = await store.search(interaction.guild_id, "speakers", current)
+        return [app_commands.Choice(name=name, value=filename) for name, filename in matches]
 
 
     @app_commands.command(name="rename-speaker", description="Rename a Speaker")
@@ -145,33 +210,28 @@ class Create_Speaker(commands.Cog):
     @app_commands.autocomplete(speaker=autocomplete_speakers)
     async def rename_speaker(self, interaction : discord.Interaction, new_name : str, speaker : str) :
         # Ricavo il nome dello speaker
-        current_name = await self.get_speaker_name(speaker)
-
-        # Apro il file json degli speaker
-        SPEAKERSJSON = await get_guild_json(interaction.guild_id, "speakers")
-        ALIASJSON = await get_guild_json(interaction.guild_id, "speakers", json_name="alias.json")
-        with open(SPEAKERSJSON, "r", encoding="utf-8") as f:
-            current_speakers = json.load(f)
-            current_speakers[new_name] = current_speakers.pop(current_name)
-
-        # Aggiorno gli alias
-        with open(ALIASJSON, "r", encoding="utf-8") as f :
-            speaker_alisase = json.load(f)
-            speaker_alisase[current_name] = new_name
-
-        # Scrivo i Dati
-        with open(ALIASJSON, "w", encoding="utf-8") as f:
-            json.dump(speaker_alisase, f, indent=4)
-
-        with open(SPEAKERSJSON, "w", encoding="utf-8") as f:
-            json.dump(current_speakers, f, indent=4)
+        current_name = await self.get_speaker_name(interaction, speaker)
+        if not current_name:
+            await interaction.response.send_message("❌ Speaker non trovato!", ephemeral=True)
+            return
 
+        # Rinomina e alias nella stessa transazione
+        await store.rename(interaction.guild_id, "speakers", current_name, new_name)
 
         await interaction.response.send_message("✅ Speaker Rinominato!")
 
     @app_commands.command(name="new-speaker", description="Registra la voce di un utente specifico")
-    @app_commands.describe(target="L'utente da registrare (lascia vuoto per te stesso)")
-    async def create_speaker(self, interaction: discord.Interaction, target: discord.Member = None):
+    @app_commands.describe(
+        target="L'utente da registrare (lascia vuoto per te stesso)",
+        formato="WAV pronto all'uso, oppure Opus (circa 10 volte più piccolo, decodificato al primo uso)",
+    )
+    @app_commands.choices(
+        formato=[
+            app_commands.Choice(name="WAV", value="wav"),
+            app_commands.Choice(name="Opus", value="ogg"),
+        ])
+    async def create_speaker(self, interaction: discord.Interaction, target: discord.Member = None,
+                             formato: str = "wav"):
         SPEAKERS_DIR = await get_guild_dir(interaction.guild_id, "speakers")
         SPEAKERS_DIR.mkdir(parents=True, exist_ok=True) # Assicura che la cartella esista
 
@@ -200,8 +260,15 @@ class Create_Speaker(commands.Cog):
         else:
             vc = interaction.guild.voice_client
 
+        # Più utenti si registrano nella stessa sessione, ognuno con la sua traccia
+        session = self.sessions.get(interaction.guild_id)
         if vc.is_listening():
-            return await interaction.followup.send("⚠️ Sto già registrando un'altra sessione!", ephemeral=True)
+            if session is None or session.closed or not session.tracks:
+                return await interaction.followup.send("⚠️ Sto già registrando un'altra sessione!", ephemeral=True)
+            if target_user.id in session.tracks:
+                return await interaction.followup.send(f"⚠️ Sto già registrando {target_user.mention}!", ephemeral=True)
+        else:
+            session = self.sessions[interaction.guild_id] = MultiUserSink(opus=formato == "ogg")
 
         # Generazione nome file univoco
         unique_id = uuid.uuid4()
@@ -210,10 +277,15 @@ class Create_Speaker(commands.Cog):
         if not safe_username:
             safe_username = "unknown_user"
 
-        filename = SPEAKERS_DIR / f"{safe_username}_{unique_id}.wav"
+        speaker_filename = f"{safe_username}_{unique_id}.{formato}"
+        filename = SPEAKERS_DIR / speaker_filename
 
         # Avvio ascolto filtrato
-        vc.listen(UserSpecificSink(str(filename), target_user))
+        sink_cls = OpusSink if formato == "ogg" else UserSpecificSink
+        sink = sink_cls(str(filename), target_user)
+        session.add(sink)
+        if not vc.is_listening():
+            vc.listen(session)
 
         # Creazione Embed
         embed = discord.Embed(
@@ -227,13 +299,13 @@ class Create_Speaker(commands.Cog):
         embed.set_footer(text="Premi il pulsante per terminare e salvare.")
 
         # Invio Embed con Pulsante (tramite followup perché abbiamo già risposto con "Connessione...")
-        view = RecorderView(vc, str(filename))
+        view = RecorderView(vc, str(filename), session, sink)
         await interaction.followup.send(embed=embed, view=view, ephemeral=True)
 
         await self.save_speaker(
             interaction,
             target_user.name,
-            speaker_filename=f"{safe_username}_{unique_id}.wav"
+            speaker_filename=speaker_filename
         )
 
 
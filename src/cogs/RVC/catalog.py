@@ -0,0 +1,225 @@
+"""Catalog of the RVC voice models.
+
+Everything a cover needs to know about a checkpoint (RVC version, target
+sample rate, f0 support, size, content hash, matching ``.index`` file) is
+read once, when the file appears or changes, and kept in ``catalog.json``
+next to the models. Jobs and autocomplete read the catalog; nothing
+deserializes a multi-hundred-MB checkpoint just to look at its header.
+
+A model is a folder inside ``models/`` with its ``.pth`` (and usually a
+``.index``), as rvc-python expects; a bare ``.pth`` directly in ``models/``
+works too. Display names come from ``RVC/index.json`` (name -> model);
+models that are not listed there show up under their own name.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from cogs import lazy_import
+from cogs.core.search import SearchIndex
+
+RVC_DIR = Path(__file__).parent.absolute()
+CATALOG_FILENAME = "catalog.json"
+# Aumentare quando cambia cosa si legge dai checkpoint: forza una nuova ispezione
+CATALOG_VERSION = 1
+
+
+class ModelInfo:
+    def __init__(self, name: str, checkpoint: str, version: str, sample_rate: int, f0: bool,
+                 size: int, mtime_ns: int, sha256: str, index_path: Optional[str]):
+        self.name = name
+        self.checkpoint = checkpoint
+        self.version = version
+        self.sample_rate = sample_rate
+        self.f0 = f0
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+        self.index_path = index_path
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ModelInfo":
+        return cls(**data)
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _scan(models_dir: Path) -> dict[str, tuple[Path, Optional[Path]]]:
+    """model name -> (checkpoint, index file) for every model in ``models_dir``."""
+    found: dict[str, tuple[Path, Optional[Path]]] = {}
+    for entry in sorted(models_dir.iterdir()):
+        if entry.is_dir():
+            checkpoints = sorted(entry.glob("*.pth"))
+            if checkpoints:
+                indexes = sorted(entry.glob("*.index"))
+                found[entry.name] = (checkpoints[0], indexes[0] if indexes else None)
+        elif entry.suffix == ".pth":
+            # .pth sciolto: l'indice è quello che ne contiene il nome, se c'è
+            stem = entry.stem.lower()
+            indexes = [i for i in sorted(models_dir.glob("*.index")) if stem in i.stem.lower()]
+            found[entry.name] = (entry, indexes[0] if indexes else None)
+    return found
+
+
+def inspect_checkpoint(path: Path) -> tuple[str, int, bool]:
+    """(version, target sample rate, f0) of an RVC checkpoint. Slow: loads the file."""
+    torch = lazy_import("torch")
+    checkpoint = torch.load(path, map_location="cpu")
+    config = checkpoint.get("config") or []
+
+    # Verifica la dimensione nei pesi: v1 = 256, v2 = 512
+    version = None
+    for key, weight in checkpoint.get("weight", {}).items():
+        if "dec.cond.weight" in key:
+            version = "v1" if weight.shape[0] == 256 else "v2"
+            break
+    if version is None:
+        # Se non lo trova nei pesi, prova nel config
+        version = ("v2" if config[17] == 512 else "v1") if len(config) > 17 else "v2"
+
+    # L'ultimo valore del config è il sample rate di uscita
+    sample_rate = int(config[-1]) if config else 40000
+    f0 = bool(checkpoint.get("f0", 1))
+    return version, sample_rate, f0
+
+
+class ModelCatalog:
+    STAT_INTERVAL = 2.0
+
+    def __init__(self, models_dir: Path, names_path: Path):
+        self.models_dir = models_dir
+        self.names_path = names_path
+        self.path = models_dir / CATALOG_FILENAME
+        self._models: dict[str, ModelInfo] = {}
+        self._names: dict[str, str] = {}
+        self._search = SearchIndex({})
+        # Checkpoint illeggibili (modello -> (size, mtime)): non si riprovano finché non cambiano
+        self._failed: dict[str, tuple[int, int]] = {}
+        self._loaded = False
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    # --- Lettura e scrittura (in un thread) ----------------------------------
+
+    def _read_catalog(self) -> dict[str, ModelInfo]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Catalogo modelli non valido ({self.path}): {e}")
+            return {}
+        if data.get("version") != CATALOG_VERSION:
+            return {}
+        return {name: ModelInfo.from_dict(info) for name, info in data["models"].items()}
+
+    def _write_catalog(self, models: dict[str, ModelInfo]) -> None:
+        data = {
+            "version": CATALOG_VERSION,
+            "models": {name: info.to_dict() for name, info in sorted(models.items())},
+        }
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _read_names(self) -> dict[str, str]:
+        try:
+            with open(self.names_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Indice JSON non valido ({self.names_path}): {e}")
+            return {}
+
+    def _refresh_sync(self) -> tuple[dict[str, ModelInfo], dict[str, str]]:
+        known = self._models if self._loaded else self._read_catalog()
+        models: dict[str, ModelInfo] = {}
+        changed = not self._loaded and not self.path.exists()
+        for name, (path, index) in _scan(self.models_dir).items():
+            stat = path.stat()
+            info = known.get(name)
+            if info is not None and info.size == stat.st_size and info.mtime_ns == stat.st_mtime_ns:
+                models[name] = info
+                continue
+            if self._failed.get(name) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            # File nuovo o modificato: unica volta in cui si apre il checkpoint
+            print(f"Catalogo RVC: analisi di {name}...")
+            try:
+                version, sample_rate, f0 = inspect_checkpoint(path)
+            except Exception as e:
+                print(f"Errore rilevamento ({name}): {e}")
+                self._failed[name] = (stat.st_size, stat.st_mtime_ns)
+                continue
+            models[name] = ModelInfo(
+                name, path.relative_to(self.models_dir).as_posix(), version, sample_rate, f0,
+                stat.st_size, stat.st_mtime_ns, _sha256(path),
+                index.relative_to(self.models_dir).as_posix() if index else None,
+            )
+            changed = True
+        if changed or models.keys() != known.keys():
+            self._write_catalog(models)
+
+        names = {label: name for label, name in self._read_names().items() if name in models}
+        listed = set(names.values())
+        for name in models:
+            if name not in listed:
+                # Cartella "voce" e file "voce.pth": il secondo tiene il nome completo
+                label = Path(name).stem
+                names[name if label in names else label] = name
+        return models, names
+
+    async def _refresh(self) -> None:
+        if self._loaded and time.monotonic() - self._checked_at < self.STAT_INTERVAL:
+            return
+        async with self._lock:
+            if self._loaded and time.monotonic() - self._checked_at < self.STAT_INTERVAL:
+                return
+            if not self.models_dir.exists():
+                models, names = {}, {}
+            else:
+                models, names = await asyncio.to_thread(self._refresh_sync)
+            self._models, self._names = models, names
+            self._search.sync(names)
+            self._loaded = True
+            self._checked_at = time.monotonic()
+
+    # --- API -----------------------------------------------------------------
+
+    async def models(self) -> dict[str, ModelInfo]:
+        """model name -> ModelInfo of every model in the folder."""
+        await self._refresh()
+        return self._models
+
+    async def get(self, name: str) -> Optional[ModelInfo]:
+        await self._refresh()
+        return self._models.get(name)
+
+    async def search(self, query: str, limit: int = 25) -> list[tuple[str, str]]:
+        """Ranked (display name, model name) matches for autocomplete."""
+        await self._refresh()
+        return self._search.search(query, limit)
+
+    def touch(self, name: str) -> None:
+        for label in self._search.names_for(name):
+            self._search.touch(label)
+
+
+catalog = ModelCatalog(RVC_DIR / "models", RVC_DIR / "index.json")
@@ -0,0 +1,234 @@
+"""Chunked RVC conversion on NumPy arrays.
+
+The vocals are decoded once to a 16 kHz mono float32 array (what the RVC
+pipeline works on), cut into overlapping chunks and each chunk is handed to
+the pipeline as an array: no chunk WAVs are written or read back. Chunks are
+cut at the quietest frame near each nominal boundary, so seams fall in
+pauses. Converted chunks are added into one preallocated float32 buffer at
+their position, with a vectorized equal-power crossfade over the overlap, so
+assembly is linear in the length of the song.
+"""
+
+import math
+import os
+import sys
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from cogs import lazy_import
+
+if TYPE_CHECKING:
+    from rvc_python.infer import RVCInference
+
+# Sample rate di ingresso della pipeline RVC (hubert lavora a 16 kHz)
+RVC_INPUT_SR = 16000
+CHUNK_SECONDS = 60.0
+OVERLAP_SECONDS = 0.5
+# Il taglio si cerca entro ±SEAM_SEARCH_SECONDS dal confine nominale, a frame da 20 ms
+SEAM_SEARCH_SECONDS = 5.0
+SEAM_FRAME_SECONDS = 0.02
+# Percorso fittizio con cui un array arriva alla pipeline al posto di un file
+ARRAY_PATH = "<array>"
+
+_local = threading.local()
+
+
+def read_wav(path) -> tuple[np.ndarray, int]:
+    """A WAV file as float32 (full scale = 1.0) and its sample rate."""
+    wavfile = lazy_import("scipy.io.wavfile")
+    sr, data = wavfile.read(path)
+    if data.dtype.kind in "iu":
+        scale = float(np.iinfo(data.dtype).max) + 1
+        data = data.astype(np.float32) / scale
+    return data.astype(np.float32, copy=False), sr
+
+
+def load_vocals(path) -> np.ndarray:
+    """A WAV file as mono float32 at ``RVC_INPUT_SR``."""
+    return prepare_vocals(*read_wav(path))
+
+
+def prepare_vocals(data: np.ndarray, sr: int) -> np.ndarray:
+    """Float ``data`` ((samples,) or (samples, channels)) as mono float32 at ``RVC_INPUT_SR``."""
+    signal = lazy_import("scipy.signal")
+    data = data.astype(np.float32, copy=False)
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if sr != RVC_INPUT_SR:
+        g = math.gcd(sr, RVC_INPUT_SR)
+        data = signal.resample_poly(data, RVC_INPUT_SR // g, sr // g).astype(np.float32)
+    return data
+
+
+# --- Array verso la pipeline ------------------------------------------------
+
+def _install_array_loader(rvc: "RVCInference") -> bool:
+    """
+    Lets ``vc_single`` read ``ARRAY_PATH`` from memory: the ``load_audio`` it
+    calls (ffmpeg on a file) is wrapped once per process. False if this
+    rvc-python does not expose it, in which case files are used.
+    """
+    module = sys.modules.get(type(rvc.vc).__module__)
+    original = getattr(module, "load_audio", None)
+    if original is None:
+        return False
+    if getattr(original, "accepts_arrays", False):
+        return True
+
+    def load_audio(file, sr, *args, **kwargs):
+        audio = getattr(_local, "audio", None)
+        if file == ARRAY_PATH and audio is not None and sr == RVC_INPUT_SR:
+            # vc_single normalizza l'audio sul posto
+            return audio.copy()
+        return original(file, sr, *args, **kwargs)
+
+    load_audio.accepts_arrays = True
+    module.load_audio = load_audio
+    return True
+
+
+def _infer_via_files(rvc: "RVCInference", audio: np.ndarray) -> np.ndarray:
+    wavfile = lazy_import("scipy.io.wavfile")
+    with tempfile.TemporaryDirectory() as tmp:
+        chunk_input = os.path.join(tmp, "chunk.wav")
+        chunk_output = os.path.join(tmp, "out.wav")
+        wavfile.write(chunk_input, RVC_INPUT_SR, audio)
+        rvc.infer_file(chunk_input, chunk_output)
+        _, out = wavfile.read(chunk_output)
+    return out
+
+
+def infer_array(rvc: "RVCInference", audio: np.ndarray) -> tuple[np.ndarray, int]:
+    """Converts ``audio`` (16 kHz mono float32); returns float32 samples and their rate."""
+    if not _install_array_loader(rvc):
+        out = _infer_via_files(rvc, audio)
+    else:
+        vc = rvc.vc
+        original = vc.vc_single
+        result = {}
+
+        def capture(*args, **kwargs):
+            result["wav"] = original(*args, **kwargs)
+            return result["wav"]
+
+        # infer_file passa a vc_single le stesse opzioni di sempre (indice,
+        # protect, ...); dell'output su file non c'è bisogno
+        _local.audio = audio
+        vc.vc_single = capture
+        try:
+            rvc.infer_file(ARRAY_PATH, os.devnull)
+        finally:
+            del vc.vc_single
+            _local.audio = None
+        out = result.get("wav")
+        if not isinstance(out, np.ndarray):
+            raise RuntimeError(f"Conversione RVC fallita: {out}")
+
+    if out.dtype.kind in "iu":
+        out = out.astype(np.float32) / (float(np.iinfo(out.dtype).max) + 1)
+    if out.ndim > 1:
+        out = out.mean(axis=1)
+    return out.astype(np.float32, copy=False), rvc.vc.tgt_sr
+
+
+# --- Chunk e assemblaggio ---------------------------------------------------
+
+def plan_chunks(audio: np.ndarray, chunk: int, overlap: int,
+                search: int = int(SEAM_SEARCH_SECONDS * RVC_INPUT_SR)) -> list[tuple[int, int]]:
+    """
+    (start, end) of chunks of about ``chunk`` samples. Each cut is placed at
+    the lowest-energy frame within ``search`` of the nominal boundary and the
+    two chunks around it share ``overlap`` samples centred on it.
+    """
+    length = len(audio)
+    if length <= chunk + search:
+        return [(0, length)]
+    frame = int(SEAM_FRAME_SECONDS * RVC_INPUT_SR)
+    frames = length // frame
+    # Energia di ogni frame, calcolata una volta per tutta la traccia
+    energy = np.square(audio[:frames * frame], dtype=np.float32).reshape(frames, frame).mean(axis=1)
+
+    cuts = [0]
+    while length - cuts[-1] > chunk + search:
+        nominal = cuts[-1] + chunk
+        lo = max((nominal - search) // frame, cuts[-1] // frame + 1)
+        hi = min((nominal + search) // frame, frames)
+        quietest = lo + int(np.argmin(energy[lo:hi]))
+        cuts.append(quietest * frame + frame // 2)
+    cuts.append(length)
+
+    half = overlap // 2
+    return [
+        (max(0, start - half), min(length, end + half))
+        for start, end in zip(cuts[:-1], cuts[1:])
+    ]
+
+
+class ChunkAssembler:
+    """
+    Preallocated output track. Each chunk is trimmed or padded to the exact
+    duration of its input (so the result stays in sync with the instrumental)
+    and crossfaded with its neighbours over the shared region.
+    """
+
+    def __init__(self, bounds: list[tuple[int, int]], in_rate: int, out_rate: int):
+        self.bounds = bounds
+        self.ratio = out_rate / in_rate
+        self.out_rate = out_rate
+        self.buffer = np.zeros(self._pos(bounds[-1][1]), dtype=np.float32)
+
+    def _pos(self, sample: int) -> int:
+        return int(round(sample * self.ratio))
+
+    def fades(self, length: int) -> tuple[np.ndarray, np.ndarray]:
+        """Equal-power (fade in, fade out) over ``length`` samples: squares sum to 1."""
+        t = np.linspace(0.0, 1.0, length + 2, dtype=np.float32)[1:-1]
+        return np.sin(t * (np.pi / 2)), np.cos(t * (np.pi / 2))
+
+    def add(self, index: int, data: np.ndarray) -> None:
+        start, end = self.bounds[index]
+        out_start, out_end = self._pos(start), self._pos(end)
+        size = out_end - out_start
+        # --- CORREZIONE SINCRONIZZAZIONE: stessa durata dell'originale ---
+        if len(data) >= size:
+            data = data[:size]
+        else:
+            data = np.pad(data, (0, size - len(data)))
+        weight = np.ones(size, dtype=np.float32)
+        if index > 0:
+            head = self._pos(self.bounds[index - 1][1]) - out_start
+            weight[:head] = self.fades(head)[0]
+        if index < len(self.bounds) - 1:
+            tail = out_end - self._pos(self.bounds[index + 1][0])
+            weight[size - tail:] = self.fades(tail)[1]
+        self.buffer[out_start:out_end] += data * weight
+
+
+def convert_chunks(rvc: "RVCInference", audio: np.ndarray,
+                   chunk_seconds: float = CHUNK_SECONDS,
+                   overlap_seconds: float = OVERLAP_SECONDS) -> tuple[np.ndarray, int]:
+    """Converts ``audio`` chunk by chunk; returns the assembled track and its rate."""
+    if len(audio) == 0:
+        raise ValueError("Traccia vocale vuota.")
+    bounds = plan_chunks(
+        audio, int(chunk_seconds * RVC_INPUT_SR), int(overlap_seconds * RVC_INPUT_SR)
+    )
+    print(f"Inizio processing a chunk: {len(audio) // RVC_INPUT_SR}s totali.")
+    assembler: Optional[ChunkAssembler] = None
+    for index, (start, end) in enumerate(bounds):
+        print(f"Processando segmento: {start // RVC_INPUT_SR}s - {end // RVC_INPUT_SR}s...")
+        out, out_rate = infer_array(rvc, audio[start:end])
+        if assembler is None:
+            assembler = ChunkAssembler(bounds, RVC_INPUT_SR, out_rate)
+        assembler.add(index, out)
+    return assembler.buffer, assembler.out_rate
+
+
+def write_wav(path, samples: np.ndarray, sr: int) -> None:
+    """Writes float32 ``samples`` as a 16-bit WAV."""
+    wavfile = lazy_import("scipy.io.wavfile")
+    pcm = np.clip(np.round(samples * 32767.0), -32768, 32767).astype(np.int16)
+    wavfile.write(path, sr, pcm)
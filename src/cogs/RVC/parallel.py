@@ -0,0 +1,138 @@
+"""Parallel RVC conversion across worker processes (CPU nodes).
+
+On CPU a single conversion keeps only a few cores busy. With ``RVC_WORKERS``
+set above 1, the vocals are cut into about one chunk per worker (seams at
+quiet frames, see ``chunks.plan_chunks``), the chunks are converted at the
+same time by a pool of processes, each holding its own loaded model, and
+reassembled in the main process with equal-power crossfades.
+
+The pool is started on the first cover and kept: a worker reloads its model
+only when a job asks for a different voice.
+
+- RVC_WORKERS  worker processes (default: 0, conversion in the bot process)
+"""
+
+import asyncio
+import gc
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from cogs import lazy_import
+from cogs.RVC import chunks
+from cogs.RVC.pool import DEVICE, load_inference, load_target
+
+if TYPE_CHECKING:
+    from cogs.RVC.catalog import ModelInfo
+
+WORKERS = int(os.getenv("RVC_WORKERS", "0"))
+# Sotto questa durata un chunk non vale il costo di spedirlo a un altro processo
+MIN_CHUNK_SECONDS = 15.0
+
+# --- Processo worker -------------------------------------------------------------
+
+# (spec del modello, istanza caricata) del worker corrente
+_worker_model: Optional[tuple] = None
+
+
+def _init_worker(threads: int) -> None:
+    from cogs.RVC.rvc import load_backend
+    lazy_import("torch").set_num_threads(threads)
+    load_backend()
+
+
+def _convert_chunk(spec: tuple, f0method: str, f0up_key: int,
+                   audio: np.ndarray) -> tuple[np.ndarray, int]:
+    global _worker_model
+    if _worker_model is None or _worker_model[0] != spec:
+        # Voce diversa dal job precedente: libera la vecchia prima di caricare
+        _worker_model = None
+        gc.collect()
+        models_dir, target, version, device, _ = spec
+        _worker_model = (spec, load_inference(models_dir, target, version, device))
+    rvc = _worker_model[1]
+    rvc.f0method = f0method
+    rvc.f0up_key = f0up_key
+    return chunks.infer_array(rvc, audio)
+
+
+# --- Processo del bot --------------------------------------------------------------
+
+class ParallelConverter:
+    def __init__(self, workers: int = WORKERS, device: str = DEVICE):
+        self.workers = workers
+        self.device = device
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # I core si dividono tra i worker: niente oversubscription dei thread di torch
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads,),
+            )
+        return self._executor
+
+    async def convert(self, models_dir, info: "ModelInfo", audio: np.ndarray,
+                      f0method: str, f0up_key: int) -> tuple[np.ndarray, int]:
+        """Converts ``audio`` (16 kHz mono float32) on the worker pool."""
+        if len(audio) == 0:
+            raise ValueError("Traccia vocale vuota.")
+        models_dir = str(models_dir)
+        spec = (models_dir, load_target(models_dir, info), info.version, self.device, info.sha256)
+        seconds = len(audio) / chunks.RVC_INPUT_SR
+        chunk_seconds = min(chunks.CHUNK_SECONDS, max(MIN_CHUNK_SECONDS, seconds / self.workers))
+        bounds = chunks.plan_chunks(
+            audio,
+            int(chunk_seconds * chunks.RVC_INPUT_SR),
+            int(chunks.OVERLAP_SECONDS * chunks.RVC_INPUT_SR),
+        )
+        print(f"Conversione parallela: {len(bounds)} chunk su {self.workers} processi.")
+
+        results = await self._run_chunks(spec, f0method, f0up_key, audio, bounds)
+
+        out_rate = results[0][1]
+        assembler = chunks.ChunkAssembler(bounds, chunks.RVC_INPUT_SR, out_rate)
+        for index, (out, _) in enumerate(results):
+            assembler.add(index, out)
+        return assembler.buffer, out_rate
+
+    async def _run_chunks(self, spec: tuple, f0method: str, f0up_key: int, audio: np.ndarray,
+                          bounds: list[tuple[int, int]]) -> list[tuple[np.ndarray, int]]:
+        loop = asyncio.get_running_loop()
+        for attempt in (1, 2):
+            executor = self._get_executor()
+            try:
+                return await asyncio.gather(*(
+                    loop.run_in_executor(executor, _convert_chunk, spec, f0method, f0up_key, audio[start:end])
+                    for start, end in bounds
+                ))
+            except BrokenProcessPool:
+                # Un worker è morto (di solito memoria esaurita): il pool non è più
+                # utilizzabile, se ne crea uno nuovo e si riprova una volta
+                self.shutdown()
+                if attempt == 2:
+                    raise RuntimeError(
+                        "Un processo di conversione RVC è terminato in modo anomalo "
+                        "(memoria insufficiente?). Riprova o riduci RVC_WORKERS."
+                    )
+                print("Pool di conversione RVC rotto: lo ricreo e riprovo.")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+converter = ParallelConverter()
@@ -0,0 +1,181 @@
+"""Pool of resident RVC voice models.
+
+Building an ``RVCInference`` and loading a voice costs seconds (weights,
+plus hubert and rmvpe on the first inference), and the cover queue often
+runs several jobs in a row with the same few voices. The pool keeps loaded
+instances in an LRU bounded by ``RVC_POOL_MB`` of weights (RAM or VRAM,
+whichever ``RVC_DEVICE`` is) and hands the same instance to the next job
+that asks for that voice. The hubert and rmvpe feature extractors do not
+depend on the voice: they are loaded once and shared by every instance.
+
+- RVC_DEVICE   device for inference (default: cuda)
+- RVC_POOL_MB  budget for resident voice weights (default: 2048)
+"""
+
+import asyncio
+import gc
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator
+
+from cogs import lazy_import
+
+if TYPE_CHECKING:
+    from rvc_python.infer import RVCInference
+    from cogs.RVC.catalog import ModelInfo
+
+DEVICE = os.getenv("RVC_DEVICE", "cuda")
+BUDGET_BYTES = int(os.getenv("RVC_POOL_MB", "2048")) * 1024 * 1024
+
+
+def load_inference(models_dir: str, model_name: str, version: str, device: str) -> "RVCInference":
+    """A new ``RVCInference`` with ``model_name`` loaded. Blocking."""
+    infer = lazy_import("rvc_python.infer")
+    inference = infer.RVCInference(device=device, models_dir=models_dir)
+    print(f"Modello trovato! Caricamento di {model_name}...")
+    try:
+        inference.load_model(model_name, version=version)
+    except TypeError:
+        # Se la tua versione di rvc-python non accetta 'version',
+        # caricherà secondo il suo default (solitamente v2)
+        print("Avviso: La libreria non supporta il parametro 'version' in load_model.")
+        inference.load_model(model_name)
+    return inference
+
+
+def load_target(models_dir: str, info: "ModelInfo") -> str:
+    """What to pass to ``load_model``: folders by name (rvc-python), a bare .pth by path."""
+    return info.name if "/" in info.checkpoint else str(Path(models_dir) / info.checkpoint)
+
+
+class _Entry:
+    def __init__(self, inference: "RVCInference", size: int):
+        self.inference = inference
+        self.size = size
+        self.lock = asyncio.Lock()
+
+
+class ModelPool:
+    """LRU of loaded ``RVCInference`` instances, one per voice model."""
+
+    def __init__(self, budget_bytes: int = BUDGET_BYTES, device: str = DEVICE):
+        self.budget_bytes = budget_bytes
+        self.device = device
+        self.hits = 0
+        self.misses = 0
+        # Chiave (cartella, modello, hash): un modello sostituito sul disco viene ricaricato
+        self._entries: OrderedDict[tuple[str, str, str], _Entry] = OrderedDict()
+        self._loading: dict[tuple[str, str, str], asyncio.Future] = {}
+        # Estrattori di feature condivisi da tutte le voci (attributo -> modello)
+        self._shared: dict[str, object] = {}
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    # --- Estrattori condivisi ------------------------------------------------
+
+    def _attach_shared(self, inference: "RVCInference") -> None:
+        vc = inference.vc
+        if "hubert_model" in self._shared and getattr(vc, "hubert_model", None) is None:
+            vc.hubert_model = self._shared["hubert_model"]
+        pipeline = getattr(vc, "pipeline", None)
+        if pipeline is not None and "model_rmvpe" in self._shared:
+            pipeline.model_rmvpe = self._shared["model_rmvpe"]
+
+    def _collect_shared(self, inference: "RVCInference") -> None:
+        # hubert e rmvpe vengono caricati pigramente alla prima inferenza
+        vc = inference.vc
+        if getattr(vc, "hubert_model", None) is not None:
+            self._shared.setdefault("hubert_model", vc.hubert_model)
+        pipeline = getattr(vc, "pipeline", None)
+        if getattr(pipeline, "model_rmvpe", None) is not None:
+            self._shared.setdefault("model_rmvpe", pipeline.model_rmvpe)
+
+    # --- Caricamento ---------------------------------------------------------
+
+    def _load_sync(self, models_dir: str, model_name: str, version: str) -> _Entry:
+        inference = load_inference(models_dir, model_name, version, self.device)
+        net_g = getattr(inference.vc, "net_g", None)
+        size = sum(p.numel() * p.element_size() for p in net_g.parameters()) if net_g is not None else 0
+        return _Entry(inference, size)
+
+    async def _get(self, models_dir: str, info: "ModelInfo") -> _Entry:
+        key = (models_dir, info.name, info.sha256)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        # Due job sulla stessa voce aspettano lo stesso caricamento
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            entry = await asyncio.to_thread(
+                self._load_sync, models_dir, load_target(models_dir, info), info.version
+            )
+            self.misses += 1
+            self._entries[key] = entry
+            future.set_result(entry)
+        except BaseException as e:
+            future.set_exception(e)
+            # Nessuno aspetta: evita "exception was never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+        return entry
+
+    def _evict(self, keep: _Entry) -> None:
+        evicted = False
+        for key, entry in list(self._entries.items()):
+            if self.resident_bytes <= self.budget_bytes:
+                break
+            if entry is keep or entry.lock.locked():
+                continue
+            del self._entries[key]
+            print(f"RVC: scaricato {key[1]} dal pool")
+            evicted = True
+        if evicted:
+            gc.collect()
+            torch = lazy_import("torch")
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    @asynccontextmanager
+    async def acquire(self, models_dir, info: "ModelInfo") -> AsyncIterator["RVCInference"]:
+        """
+        The pooled instance for the model described by ``info`` (from the
+        catalog), loaded if needed. Held exclusively for the duration of the
+        ``async with`` block.
+        """
+        entry = await self._get(str(models_dir), info)
+        async with entry.lock:
+            self._attach_shared(entry.inference)
+            try:
+                yield entry.inference
+            finally:
+                self._collect_shared(entry.inference)
+                self._evict(keep=entry)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._shared.clear()
+        gc.collect()
+
+    def stats(self) -> dict:
+        return {
+            "models": [key[1] for key in self._entries],
+            "resident_mb": self.resident_bytes / (1024 * 1024),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+pool = ModelPool()
@@ -1,25 +1,46 @@
-import yt_dlp
-import demucs
-import subprocess
 import discord
 from discord.ext import commands
-from pedalboard import Pedalboard, Compressor, Reverb, LadderFilter, NoiseGate, Gain
-from pedalboard.io import AudioFile
-from pydub import AudioSegment
-from rvc_python.infer import RVCInference
 from pathlib import Path
+from typing import TYPE_CHECKING
 import os
 import gc
-import torch
 import asyncio
-import sys
 import shutil
-# Sblocca le classi necessarie per fairseq/RVC
-from fairseq.data.dictionary import Dictionary
-torch.serialization.add_safe_globals([Dictionary])
+import threading
+import numpy as np
+from cogs import lazy_import
+from cogs.audio import loudness
+from cogs.RVC import chunks, parallel
+from cogs.RVC.catalog import catalog
+from cogs.RVC.pool import pool
+from cogs.RVC.separator import separator
+
+# Lo stack ML (torch, fairseq, rvc_python, demucs, pedalboard, pydub, yt_dlp)
+# si importa con load_backend() al primo utilizzo o in background,
+# non quando il bot carica i cog
+if TYPE_CHECKING:
+    from rvc_python.infer import RVCInference
+
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:128,expandable_segments:True"
 os.chdir(os.path.abspath("./"))
 
+BACKEND_MODULES = ("torch", "yt_dlp", "pydub", "pedalboard", "rvc_python.infer")
+_backend_lock = threading.Lock()
+_backend_ready = False
+
+def load_backend() -> None:
+    """Importa lo stack ML pesante una volta sola. Sincrono: va chiamato in un thread."""
+    global _backend_ready
+    with _backend_lock:
+        if _backend_ready:
+            return
+        for module in BACKEND_MODULES:
+            lazy_import(module)
+        # Sblocca le classi necessarie per fairseq/RVC
+        dictionary = lazy_import("fairseq.data.dictionary").Dictionary
+        lazy_import("torch").serialization.add_safe_globals([dictionary])
+        _backend_ready = True
+
 BASE_DATA_DIR = Path(__file__).parent.absolute()
 
 async def get_guild_dir(guild_id: int, subfolder: str) -> Path:
@@ -44,6 +65,7 @@ async def delete_temp_guild_dir(interaction : discord.Interaction, temp_dir : Pa
     if os.path.exists(temp_dir) :
         os.rmdir(temp_dir)
 async def download_video(temp_dir : Path, url : str) :
+    import yt_dlp
     os.chdir(temp_dir)
     yt_opts = {
         'format': 'bestaudio/best',
@@ -59,126 +81,57 @@ async def download_video(temp_dir : Path, url : str) :
     os.chdir("./")
 
 async def separate_audio(temp_dir : Path, input_file):
+    """
+    Separa voce e base con htdemucs, nel processo del bot e con il modello già
+    caricato. Restituisce i vocals (array, sample rate) e il percorso della base.
+    """
     # Utilizza il modello htdemucs (molto preciso)
-    os.chdir(temp_dir)
     def run_demucs() :
-        subprocess.run([sys.executable, "-m", "demucs.separate", "-n", "htdemucs", "--two-stems=vocals", input_file])
-    await asyncio.to_thread(run_demucs)
-    torch.cuda.empty_cache()
+        audio = chunks.read_wav(temp_dir / input_file)
+        vocals, instrumental, sample_rate = separator.separate(*audio)
+        instrumental_path = temp_dir / "no_vocals.wav"
+        chunks.write_wav(instrumental_path, instrumental, sample_rate)
+        return vocals, sample_rate, str(instrumental_path)
+    result = await asyncio.to_thread(run_demucs)
     gc.collect()
-    os.chdir(Path(__file__).parent.absolute())
-
-async def get_rvc_version(model_path, model_name):
-    """
-    Ispeziona il file .pth per determinare se è RVC v1 o v2.
-    """
-    try:
-        # Costruisce il percorso completo al file .pth
-        full_path = Path(model_path) / model_name
-        checkpoint = torch.load(full_path, map_location="cpu")
-
-        # Verifica la dimensione nei pesi
-        # v1 = 256, v2 = 512
-        if "weight" in checkpoint:
-            for key in checkpoint["weight"].keys():
-                if "dec.cond.weight" in key:
-                    dim = checkpoint["weight"][key].shape[0]
-                    return "v1" if dim == 256 else "v2"
-
-        # Se non lo trova nei pesi, prova nel config
-        if "config" in checkpoint:
-            return "v2" if checkpoint["config"][17] == 512 else "v1"
-
-        return "v2"
-    except Exception as e:
-        print(f"Errore rilevamento: {e}")
-        return "v2"
-
-async def process_in_chunks(rvc_instance: RVCInference, input_path, chunk_length_ms=30000):
-    audio = AudioSegment.from_wav(input_path)
-    duration = len(audio)
-
-    # Creiamo una base di silenzio della durata esatta del brano originale
-    # Questo garantisce che la durata finale sia identica all'originale
-    final_audio = AudioSegment.silent(duration=duration, frame_rate=44100)
-
-    temp_path = Path("temp_chunks")
-    temp_path.mkdir(exist_ok=True)
-
-    print(f"Inizio processing a chunk: {duration // 1000}s totali.")
-
-    for i in range(0, duration, chunk_length_ms):
-        end = min(i + chunk_length_ms, duration)
-        chunk = audio[i:end]
-        original_chunk_len = len(chunk) # Salviamo la durata originale esatta
-
-        chunk_input = temp_path / f"chunk_{i}.wav"
-        chunk_output = temp_path / f"out_{i}.wav"
-
-        chunk.export(chunk_input, format="wav")
-
-        print(f"Processando segmento: {i//1000}s - {end//1000}s...")
-        await asyncio.to_thread(rvc_instance.infer_file, str(chunk_input), str(chunk_output))
-
-        # Carichiamo il chunk processato
-        processed_chunk = AudioSegment.from_wav(str(chunk_output))
-
-        # --- CORREZIONE SINCRONIZZAZIONE ---
-        # 1. Tagliamo il chunk se è più lungo dell'originale
-        # 2. Aggiungiamo silenzio se è più corto (molto raro)
-        if len(processed_chunk) > original_chunk_len:
-            processed_chunk = processed_chunk[:original_chunk_len]
-        elif len(processed_chunk) < original_chunk_len:
-            diff = original_chunk_len - len(processed_chunk)
-            processed_chunk += AudioSegment.silent(duration=diff, frame_rate=44100)
-
-        # Opzionale: Applica una piccola dissolvenza (fade) di 10ms
-        # all'inizio e alla fine per evitare i "click" tra i chunk
-        processed_chunk = processed_chunk.fade_in(10).fade_out(10)
-
-        # Inseriamo il pezzo nella posizione esatta (i) della traccia finale
-        final_audio = final_audio.overlay(processed_chunk, position=i)
-
-        # Pulizia
-        if os.path.exists(chunk_input): os.remove(chunk_input)
-        if os.path.exists(chunk_output): os.remove(chunk_output)
-
-    return final_audio
-
-async def RVC(temp_dir : Path, modelpath : str, modelname : str, vocals : str, pitch: int = 0) :
+    return result
+
+async def process_in_chunks(rvc_instance: "RVCInference", audio: np.ndarray, chunk_length_ms=30000):
+    # Tutto in memoria: niente chunk su disco, assemblaggio in un buffer preallocato
+    return await asyncio.to_thread(
+        chunks.convert_chunks, rvc_instance, audio, chunk_seconds=chunk_length_ms / 1000
+    )
+
+async def RVC(temp_dir : Path, modelpath : str, modelname : str, vocals : np.ndarray,
+              vocals_sr : int, pitch: int = 0) :
+    # Versione e metadati dal catalogo: il checkpoint non viene riletto a ogni job
+    info = await catalog.get(modelname)
+    if info is None:
+        raise FileNotFoundError(f"Modello {modelname} non trovato.")
     os.chdir(temp_dir)
-    # 1. Inizializza l'istanza
-    rvc = RVCInference(device="cuda", models_dir=modelpath)
-    version = await get_rvc_version(modelpath, modelname)
-    # --- FIX PRE-ELABORAZIONE ---
-    # Carichiamo i vocals di Demucs e forziamo il formato corretto per evitare il TypeError
+    # Vocals di Demucs in mono a 16 kHz, il formato su cui lavora la pipeline RVC
     print("Conversione audio in corso per compatibilità...")
-    audio = AudioSegment.from_wav(vocals)
-    audio = audio.set_channels(1).set_frame_rate(44100)
-    clean_vocals = "vocals_cleaned.wav"
-    audio.export(clean_vocals, format="wav")
+    audio = await asyncio.to_thread(chunks.prepare_vocals, vocals, vocals_sr)
     output_file = "output.wav"
-    # 3. Caricamento e Inferenza
-    print(f"Modello trovato! Caricamento di {modelname}...")
-    try:
-        rvc.load_model(modelname, version=version)
-    except TypeError:
-        # Se la tua versione di rvc-python non accetta 'version',
-        # caricherà secondo il suo default (solitamente v2)
-        print("Avviso: La libreria non supporta il parametro 'version' in load_model.")
-        rvc.load_model(modelname)
-    rvc.f0method = "rmvpe"
-    rvc.f0up_key = pitch
-    final_audio = await process_in_chunks(rvc, clean_vocals, chunk_length_ms=60000)
-    final_audio.export(output_file, format="wav")
-    del rvc # Elimina l'oggetto che contiene il modello in VRAM
-    gc.collect() # Forza il Garbage Collector di Python
-    torch.cuda.empty_cache() # Svuota la cache di PyTorch
+    if parallel.converter.enabled:
+        # Nodi CPU: i chunk vengono convertiti insieme da più processi
+        final_audio, sample_rate = await parallel.converter.convert(
+            modelpath, info, audio, "rmvpe", pitch
+        )
+    else:
+        # Il modello resta nel pool: la prossima cover con la stessa voce non lo ricarica
+        async with pool.acquire(modelpath, info) as rvc:
+            rvc.f0method = "rmvpe"
+            rvc.f0up_key = pitch
+            final_audio, sample_rate = await process_in_chunks(rvc, audio, chunk_length_ms=60000)
+    await asyncio.to_thread(chunks.write_wav, output_file, final_audio, sample_rate)
     os.chdir(Path(__file__).parent.absolute())
     return output_file
 
 
 async def apply_pro_effects(input_wav, output_wav):
+    from pedalboard import Pedalboard, Compressor, Reverb, LadderFilter, NoiseGate, Gain
+    from pedalboard.io import AudioFile
     with AudioFile(input_wav) as f:
         samplerate = f.samplerate
         audio = f.read(f.frames)
@@ -211,6 +164,7 @@ async def mix_audio(temp_dir : Path, vocals_path, instrumental_path, final_outpu
     os.chdir(temp_dir)
     await apply_pro_effects(vocals_path, "pro-output.wav")
     def perform_mix() :
+        from pydub import AudioSegment
         print("Mixaggio finale in corso...")
 
         vocale = AudioSegment.from_wav("pro-output.wav")
@@ -225,27 +179,30 @@ async def mix_audio(temp_dir : Path, vocals_path, instrumental_path, final_outpu
         # Esporta il risultato
         combinata.export(final_output, format="wav")
         print(f"🎉 Canzone completata: {final_output}")
+
+        # Loudness misurata una volta qui: in riproduzione basta moltiplicare
+        samples = np.array(combinata.get_array_of_samples(), dtype=np.float32)
+        samples = samples.reshape(-1, combinata.channels) / float(1 << (8 * combinata.sample_width - 1))
+        gain = loudness.analyze(samples, combinata.frame_rate)
         os.chdir(Path(__file__).parent.absolute())
-        return final_output
+        return final_output, gain
 
     return await asyncio.to_thread(perform_mix)
 
 async def ai_cover(interaction : discord.Interaction, model_name : str, url : str, pitch:int = 0) :
+    await asyncio.to_thread(load_backend)
+    import torch
     temp_dir = await create_temp_guild_dir(interaction)
-    currdir = Path(__file__).parent.absolute()
-    models = currdir / "models"
+    models = catalog.models_dir
     await download_video(temp_dir, url)
-    await separate_audio(temp_dir, "canzone_originale.wav")
-    vocals = str(temp_dir / "separated" / "htdemucs" / "canzone_originale" / "vocals.wav")
-    instrumental = str(temp_dir / "separated" / "htdemucs" / "canzone_originale" / "no_vocals.wav")
-    gc.collect()
-    output = await RVC(temp_dir, models, model_name, vocals, pitch)
+    vocals, vocals_sr, instrumental = await separate_audio(temp_dir, "canzone_originale.wav")
+    output = await RVC(temp_dir, models, model_name, vocals, vocals_sr, pitch)
     output = str(temp_dir / output)
-    output = await mix_audio(temp_dir, output, instrumental)
+    output, gain = await mix_audio(temp_dir, output, instrumental)
     output = str(temp_dir / output)
     torch.cuda.empty_cache()
     # await delete_temp_guild_dir(interaction, temp_dir)
-    return output
+    return output, gain
 
 async def setup(bot) :
     pass
@@ -0,0 +1,109 @@
+"""In-process Demucs separator.
+
+``python -m demucs.separate`` per cover meant a new interpreter, a fresh
+torch import and the htdemucs weights reloaded before any work, then stems
+written into ``separated/htdemucs/<track>/`` only to be read back. Here the
+model is loaded once and kept; separation takes a waveform array and returns
+the vocal and instrumental stems as arrays.
+
+- DEMUCS_MODEL    pretrained model (default: htdemucs)
+- DEMUCS_DEVICE   device (default: cuda if available, else cpu)
+- DEMUCS_SEGMENT  segment length in seconds (default: the model's own)
+- DEMUCS_OVERLAP  overlap between segments (default: 0.25)
+- DEMUCS_SHIFTS   random shifts averaged, slower but slightly better (default: 1)
+- DEMUCS_THREADS  segments processed in parallel on CPU (default: 0, none)
+"""
+
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from cogs import lazy_import
+
+
+class Separator:
+    def __init__(self, model_name: str = "htdemucs", device: Optional[str] = None,
+                 segment: Optional[float] = None, overlap: float = 0.25,
+                 shifts: int = 1, threads: int = 0):
+        self.model_name = model_name
+        self.device = device
+        self.segment = segment
+        self.overlap = overlap
+        self.shifts = shifts
+        self.threads = threads
+        self._model = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Separator":
+        segment = os.getenv("DEMUCS_SEGMENT")
+        return cls(
+            model_name=os.getenv("DEMUCS_MODEL", "htdemucs"),
+            device=os.getenv("DEMUCS_DEVICE") or None,
+            segment=float(segment) if segment else None,
+            overlap=float(os.getenv("DEMUCS_OVERLAP", "0.25")),
+            shifts=int(os.getenv("DEMUCS_SHIFTS", "1")),
+            threads=int(os.getenv("DEMUCS_THREADS", "0")),
+        )
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def samplerate(self) -> int:
+        return self.load().samplerate
+
+    def load(self):
+        """Loads the model once (blocking: call it from a thread)."""
+        with self._lock:
+            if self._model is None:
+                torch = lazy_import("torch")
+                pretrained = lazy_import("demucs.pretrained")
+                if self.device is None:
+                    self.device = "cuda" if torch.cuda.is_available() else "cpu"
+                model = pretrained.get_model(self.model_name)
+                model.eval()
+                self._model = model.to(self.device)
+                print(f"Demucs {self.model_name} caricato su {self.device}.")
+            return self._model
+
+    def separate(self, audio: np.ndarray, sr: int) -> tuple[np.ndarray, np.ndarray, int]:
+        """
+        Splits ``audio`` (float32, shape (samples, channels) or (samples,)) into
+        vocals and everything else. Returns (vocals, instrumental, sample rate),
+        both shaped (samples, channels) at the model's sample rate. Blocking.
+        """
+        torch = lazy_import("torch")
+        apply = lazy_import("demucs.apply")
+        demucs_audio = lazy_import("demucs.audio")
+        model = self.load()
+
+        wav = torch.from_numpy(np.ascontiguousarray(audio.reshape(len(audio), -1).T))
+        wav = demucs_audio.convert_audio(wav, sr, model.samplerate, model.audio_channels)
+        # Stessa normalizzazione di demucs.separate
+        ref = wav.mean(0)
+        mean, std = ref.mean(), ref.std() + 1e-8
+        wav = (wav - mean) / std
+
+        # Un job alla volta: il modello e la memoria del device sono condivisi
+        with self._lock, torch.inference_mode():
+            sources = apply.apply_model(
+                model, wav[None], device=self.device, shifts=self.shifts, split=True,
+                overlap=self.overlap, segment=self.segment, progress=False,
+                num_workers=self.threads if self.device == "cpu" else 0,
+            )[0]
+            if self.device != "cpu":
+                torch.cuda.empty_cache()
+        sources = sources * std + mean
+
+        # Equivalente di --two-stems=vocals
+        index = model.sources.index("vocals")
+        vocals = sources[index]
+        instrumental = sources.sum(0) - vocals
+        return vocals.T.numpy(), instrumental.T.numpy(), model.samplerate
+
+
+separator = Separator.from_env()
@@ -0,0 +1,4 @@
+"""
+TTS support package.
+Helpers shared by the TTS cog: speaker conditioning, inference and caching.
+"""
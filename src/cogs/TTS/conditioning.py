@@ -0,0 +1,83 @@
+"""Speaker conditioning cache for Chatterbox.
+
+Encoding a reference clip (load, resample, voice-encoder embedding, speech
+tokens) is the same work every time the same speaker talks. Here we keep the
+resulting ``Conditionals`` in a bounded in-memory LRU and a serialized copy
+next to the speaker file, so a repeat speaker never re-encodes its prompt.
+"""
+
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+# Sottocartella (dentro speakers/) con le conditioning serializzate
+CONDS_DIRNAME = "conds"
+
+
+class ConditioningCache:
+    """LRU of Chatterbox conditionals keyed by (guild id, speaker file, mtime)."""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(guild_id: int, speaker_path: Path) -> tuple:
+        """Cache key; a re-recorded speaker gets a new mtime and a fresh entry."""
+        return guild_id, speaker_path.name, speaker_path.stat().st_mtime_ns
+
+    @staticmethod
+    def disk_path(speaker_path: Path, mtime_ns: int) -> Path:
+        return speaker_path.parent / CONDS_DIRNAME / f"{speaker_path.stem}.{mtime_ns}.pt"
+
+    def get(self, model, guild_id: int, speaker_path: Path):
+        """
+        Restituisce le conditionals per lo speaker, calcolandole solo se
+        non sono né in memoria né su disco. Sincrono: va chiamato fuori dal loop.
+        """
+        key = self.key_for(guild_id, speaker_path)
+        with self._lock:
+            conds = self._entries.get(key)
+            if conds is not None:
+                self._entries.move_to_end(key)
+                return conds
+
+        conds_file = self.disk_path(speaker_path, key[2])
+        conds = self._load(model, conds_file)
+        if conds is None:
+            model.prepare_conditionals(str(speaker_path))
+            conds = model.conds
+            self._save(conds, speaker_path.stem, conds_file)
+
+        with self._lock:
+            self._entries[key] = conds
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return conds
+
+    def _load(self, model, conds_file: Path):
+        if not conds_file.exists():
+            return None
+        try:
+            from chatterbox.mtl_tts import Conditionals
+
+            return Conditionals.load(conds_file, map_location=model.device).to(model.device)
+        except Exception as e:
+            print(f"Conditioning su disco non valida ({conds_file.name}): {e}")
+            return None
+
+    def _save(self, conds, stem: str, conds_file: Path) -> None:
+        try:
+            conds_file.parent.mkdir(parents=True, exist_ok=True)
+            # Le versioni precedenti dello stesso speaker non servono più
+            for stale in conds_file.parent.glob("*.pt"):
+                if stale.name.rsplit(".", 2)[0] == stem:
+                    stale.unlink(missing_ok=True)
+            tmp = conds_file.with_suffix(".tmp")
+            conds.save(tmp)
+            tmp.replace(conds_file)
+        except Exception as e:
+            print(f"Impossibile salvare la conditioning {conds_file.name}: {e}")
@@ -0,0 +1,94 @@
+"""CPU performance mode for Chatterbox inference.
+
+Selected with environment variables (see ``CPUSettings.from_env``):
+
+- TTS_CPU_MODE=fast   enable the mode (default: off)
+- TTS_THREADS=N       intra-op threads (default: cores available to the process)
+- TTS_QUANTIZE=0|1    dynamic int8 quantization of the T3 transformer (default: 1)
+- TTS_COMPILE=0|1     torch.compile of the flow-matching estimator (default: 0)
+
+Only the T3 token model is quantized: it is a stack of Linear layers and
+dominates CPU time. S3Gen (convolutions, vocoder) and the voice encoder stay
+in full precision, where int8 costs audible quality.
+"""
+
+import contextlib
+import os
+
+from cogs import lazy_import
+
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class CPUSettings:
+    def __init__(self, enabled: bool, threads: int, quantize: bool, compile_modules: bool):
+        self.enabled = enabled
+        self.threads = threads
+        self.quantize = quantize
+        self.compile_modules = compile_modules
+
+    @classmethod
+    def from_env(cls) -> "CPUSettings":
+        return cls(
+            enabled=os.getenv("TTS_CPU_MODE", "off").lower() == "fast",
+            threads=int(os.getenv("TTS_THREADS", "0")) or _available_cores(),
+            quantize=os.getenv("TTS_QUANTIZE", "1") == "1",
+            compile_modules=os.getenv("TTS_COMPILE", "0") == "1",
+        )
+
+    @property
+    def variant(self) -> str:
+        """Tag for caches whose content depends on the numerics (e.g. phrase cache)."""
+        if not self.enabled:
+            return ""
+        return "-int8" if self.quantize else ""
+
+    def describe(self) -> str:
+        if not self.enabled:
+            return "off"
+        return (
+            f"threads={self.threads} quantize={self.quantize} compile={self.compile_modules}"
+        )
+
+
+def configure_threads(settings: CPUSettings) -> None:
+    """Pins torch thread pools; call before the model does any work."""
+    torch = lazy_import("torch")
+    torch.set_num_threads(settings.threads)
+    try:
+        # Le op indipendenti sono poche: 1-2 thread inter-op bastano
+        torch.set_num_interop_threads(min(2, settings.threads))
+    except RuntimeError:
+        # Già fissato (il pool inter-op si può impostare una volta sola)
+        pass
+
+
+def optimize_model(model, settings: CPUSettings) -> list[str]:
+    """Applies the CPU optimizations in place; returns what was applied."""
+    torch = lazy_import("torch")
+    applied = []
+    if settings.quantize:
+        torch.ao.quantization.quantize_dynamic(
+            model.t3, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        applied.append("int8 T3")
+    if settings.compile_modules:
+        try:
+            decoder = model.s3gen.flow.decoder
+            decoder.estimator = torch.compile(decoder.estimator, dynamic=True)
+            applied.append("compiled flow estimator")
+        except Exception as e:
+            print(f"torch.compile non disponibile: {e}")
+    return applied
+
+
+def inference_context(settings: CPUSettings):
+    """``torch.inference_mode`` in fast mode; thread-local, enter it on the worker."""
+    if not settings.enabled:
+        return contextlib.nullcontext()
+    return lazy_import("torch").inference_mode()
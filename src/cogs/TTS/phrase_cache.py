@@ -0,0 +1,189 @@
+"""Content-addressed cache of rendered TTS phrases.
+
+The key is a hash of the speaker file contents, the normalized text, the
+language and the model version, so the same line from the same voice is
+synthesized only once. Entries are stored as mono 48 kHz 16-bit WAV (the TTS
+output is mono, stereo is rebuilt on read) under a disk budget with LRU
+eviction.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import unicodedata
+import wave
+from collections import OrderedDict
+from importlib import metadata
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from cogs.audio.pcm import SAMPLE_RATE, pcm_duration
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def model_version() -> str:
+    try:
+        return f"chatterbox-{metadata.version('chatterbox-tts')}"
+    except metadata.PackageNotFoundError:
+        return "chatterbox-unknown"
+
+
+class PhraseCache:
+    """Disk-backed LRU of rendered PCM with hit/miss counters."""
+
+    def __init__(self, root: Path, budget_bytes: int, version: Optional[str] = None):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.version = version or model_version()
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        # Percorso speaker -> (mtime_ns, size, digest): una voce per file
+        self._digests: dict[str, tuple[int, int, str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        # Secondi di calcolo per secondo di audio, media sulle miss
+        self._rtf = 0.0
+
+        if self.enabled:
+            self._scan()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def _scan(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.root.glob("*/*.wav"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.stem] = size
+            self._size += size
+        self._evict()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.wav"
+
+    def _speaker_digest(self, speaker_path: Path) -> str:
+        stat = speaker_path.stat()
+        memo = self._digests.get(str(speaker_path))
+        if memo is not None and memo[:2] == (stat.st_mtime_ns, stat.st_size):
+            return memo[2]
+        h = hashlib.blake2b(digest_size=16)
+        with open(speaker_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        # Un file registrato di nuovo sostituisce la voce vecchia
+        self._digests[str(speaker_path)] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def key_for(self, speaker_path: Path, text: str, language: str) -> str:
+        """Sync (reads the speaker file the first time): call it off the loop."""
+        material = "\0".join(
+            (self._speaker_digest(speaker_path), normalize_text(text), language, self.version)
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns 48 kHz stereo PCM for ``key``, or None (and counts a miss)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            known = key in self._entries
+            if known:
+                self._entries.move_to_end(key)
+        pcm = None
+        if known:
+            path = self._path(key)
+            try:
+                with wave.open(str(path), "rb") as f:
+                    mono = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+                os.utime(path)
+                pcm = np.repeat(mono, 2).tobytes()
+            except (OSError, EOFError, wave.Error):
+                self._forget(key)
+
+        with self._lock:
+            if pcm is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += pcm_duration(pcm) * self._rtf
+        return pcm
+
+    def put(self, key: str, pcm: bytes, elapsed: float) -> None:
+        """Stores a freshly generated render; ``elapsed`` is its generation time."""
+        if not self.enabled or not pcm:
+            return
+        duration = pcm_duration(pcm)
+        if duration > 0:
+            rtf = elapsed / duration
+            self._rtf = rtf if self._rtf == 0 else 0.9 * self._rtf + 0.1 * rtf
+
+        mono = np.frombuffer(pcm, dtype=np.int16)[::2]
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Temporaneo unico: due render della stessa frase non si mescolano
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as tmp:
+            try:
+                with wave.open(tmp, "wb") as f:
+                    f.setnchannels(1)
+                    f.setsampwidth(2)
+                    f.setframerate(SAMPLE_RATE)
+                    f.writeframes(mono.tobytes())
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        os.replace(tmp.name, path)
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            size = path.stat().st_size
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+        self._path(key).unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        """Drops least-recently-used entries over budget. Caller holds the lock."""
+        evicted = False
+        while self._size > self.budget_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self._path(key).unlink(missing_ok=True)
+            evicted = True
+        if evicted:
+            # Anche gli hash degli speaker eliminati nel frattempo
+            for speaker in list(self._digests):
+                if not os.path.exists(speaker):
+                    self._digests.pop(speaker, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "size_mb": self._size / (1024 * 1024),
+            "budget_mb": self.budget_bytes / (1024 * 1024),
+            "saved_seconds": self.saved_seconds,
+        }
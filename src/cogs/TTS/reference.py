@@ -0,0 +1,165 @@
+"""Reference clips for speaker conditioning.
+
+A /new-speaker recording contains leading/trailing silence, pauses and
+however many minutes the user happened to record, and Chatterbox would
+process all of it as the prompt. After a recording (or, for older speakers,
+on first use) we trim the silence and keep the best ``REFERENCE_SECONDS`` of
+clean speech in ``<stem>.ref.wav`` next to the raw file; the TTS conditions
+on that clip, and the raw recording stays untouched.
+
+Opus passthrough recordings (``.ogg``) are decoded here, once, on the way.
+"""
+
+import os
+import threading
+import wave
+from pathlib import Path
+from typing import Optional
+
+import discord
+import numpy as np
+
+from cogs.audio.ogg import PRE_SKIP, read_packets
+from cogs.audio.pcm import CHANNELS
+from cogs.audio.wav_writer import TTS_SAMPLE_RATE, Downsampler
+
+REF_SUFFIX = ".ref.wav"
+# Durata massima del clip di riferimento (Chatterbox usa al più 10 s di prompt)
+REFERENCE_SECONDS = float(os.getenv("TTS_REFERENCE_SECONDS", "10"))
+# Sotto questa quantità di parlato il clip si tiene intero
+MIN_SPEECH_SECONDS = 2.0
+# Analisi a frame da 20 ms; un frame è parlato se supera il rumore di fondo di 10 dB
+FRAME_SECONDS = 0.02
+SPEECH_MARGIN_DB = 10.0
+SPEECH_FLOOR_DB = -55.0
+# Contesto tenuto attorno al parlato: le pause più lunghe si riducono a 2 * HANGOVER
+HANGOVER_SECONDS = 0.2
+CLIP_LEVEL = 0.99
+
+_locks: dict[Path, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(path: Path) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def reference_path(path: Path) -> Path:
+    return path.with_name(path.stem + REF_SUFFIX)
+
+
+def decode_ogg(path: Path) -> np.ndarray:
+    """Decodes an Ogg Opus recording to mono int16 at ``TTS_SAMPLE_RATE``."""
+    decoder = discord.opus.Decoder()
+    convert = Downsampler(TTS_SAMPLE_RATE)
+    skip = PRE_SKIP * CHANNELS * 2
+    blocks = []
+    for packet in read_packets(str(path)):
+        pcm = decoder.decode(packet)
+        if skip:
+            # I primi campioni sono il ritardo dell'encoder (pre-skip)
+            dropped = min(skip, len(pcm))
+            pcm, skip = pcm[dropped:], skip - dropped
+        if pcm:
+            blocks.append(convert(pcm))
+    return np.frombuffer(b"".join(blocks), dtype=np.int16)
+
+
+def read_wav(path: Path) -> Optional[tuple[np.ndarray, int]]:
+    """Mono int16 samples and rate of a 16-bit PCM WAV; None for other formats."""
+    try:
+        with wave.open(str(path), "rb") as f:
+            if f.getsampwidth() != 2:
+                return None
+            channels, rate = f.getnchannels(), f.getframerate()
+            data = f.readframes(f.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    samples = np.frombuffer(data, dtype=np.int16)
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+        samples = samples.astype(np.float32).mean(axis=1).astype(np.int16)
+    return samples, rate
+
+
+def speech_mask(samples: np.ndarray, sr: int) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Per-frame (voiced, keep) masks and the frame length. ``voiced`` frames are
+    above the noise floor; ``keep`` adds ``HANGOVER_SECONDS`` around them.
+    """
+    frame = max(1, int(sr * FRAME_SECONDS))
+    count = len(samples) // frame
+    frames = samples[:count * frame].astype(np.float32).reshape(count, frame) / 32768.0
+    with np.errstate(divide="ignore"):
+        energy = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+    # Rumore di fondo stimato sul 10% dei frame più silenziosi
+    threshold = max(np.percentile(energy, 10) + SPEECH_MARGIN_DB, SPEECH_FLOOR_DB)
+    voiced = energy > threshold
+
+    hangover = int(HANGOVER_SECONDS / FRAME_SECONDS)
+    kernel = np.ones(2 * hangover + 1)
+    keep = np.convolve(voiced.astype(np.float32), kernel, mode="same") > 0
+    return voiced, keep, frame
+
+
+def select_reference(samples: np.ndarray, sr: int,
+                     seconds: float = REFERENCE_SECONDS) -> np.ndarray:
+    """Trims silence from ``samples`` and returns the best ``seconds`` of speech."""
+    if len(samples) < sr * FRAME_SECONDS:
+        return samples
+    voiced, keep, frame = speech_mask(samples, sr)
+    if voiced.sum() * FRAME_SECONDS < MIN_SPEECH_SECONDS:
+        # Quasi niente parlato riconosciuto: meglio il file intero che un clip vuoto
+        return samples
+
+    frames = samples[:len(keep) * frame].reshape(-1, frame)[keep]
+    voiced = voiced[keep]
+    clipped = np.abs(frames).max(axis=1) >= CLIP_LEVEL * 32767
+
+    window = int(seconds / FRAME_SECONDS)
+    if len(frames) > window:
+        # Finestra con più parlato e meno clipping, via somme cumulative
+        score = voiced.astype(np.int32) - 2 * clipped.astype(np.int32)
+        totals = np.concatenate(([0], np.cumsum(score)))
+        start = int(np.argmax(totals[window:] - totals[:-window]))
+        frames = frames[start:start + window]
+    return frames.reshape(-1)
+
+
+def build_reference(path: Path, target: Path) -> bool:
+    """Writes the reference clip of ``path`` to ``target``; False if the format is unsupported."""
+    if path.suffix.lower() == ".ogg":
+        samples, sr = decode_ogg(path), TTS_SAMPLE_RATE
+    else:
+        loaded = read_wav(path)
+        if loaded is None:
+            return False
+        samples, sr = loaded
+
+    clip = select_reference(samples, sr)
+    tmp = target.with_suffix(".tmp")
+    with wave.open(str(tmp), "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sr)
+        out.writeframes(clip.astype(np.int16).tobytes())
+    tmp.replace(target)
+    return True
+
+
+def prepare(path: Path) -> Path:
+    """
+    Path of the clip to condition on: the reference clip of ``path``, built
+    if missing or older than the recording. Blocking: call it from a thread.
+    """
+    path = Path(path)
+    if path.name.endswith(REF_SUFFIX):
+        return path
+    target = reference_path(path)
+    with _lock_for(path):
+        if target.exists() and target.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+            return target
+        if build_reference(path, target):
+            return target
+    return path
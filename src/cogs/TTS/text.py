@@ -0,0 +1,52 @@
+"""Text segmentation for streamed TTS playback."""
+
+import re
+
+# Fine frase: . ! ? … ; seguiti da spazio, oppure un a capo
+_SENTENCE_END = re.compile(r"(?<=[.!?…;])\s+|\n+")
+# Punti di taglio secondari per frasi troppo lunghe
+_CLAUSE_END = re.compile(r"(?<=[,:])\s+")
+
+
+def split_sentences(text: str, max_chars: int = 200, min_chars: int = 20) -> list[str]:
+    """
+    Splits ``text`` into sentences in reading order.
+
+    Sentences longer than ``max_chars`` are split again at commas/colons and,
+    failing that, at whitespace. Fragments shorter than ``min_chars`` are
+    merged into the previous one, since very short prompts synthesize badly.
+    """
+    pieces: list[str] = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in _CLAUSE_END.split(sentence):
+            pieces.extend(_wrap(clause.strip(), max_chars))
+
+    merged: list[str] = []
+    for piece in pieces:
+        if merged and (len(piece) < min_chars or len(merged[-1]) < min_chars) \
+                and len(merged[-1]) + len(piece) + 1 <= max_chars:
+            merged[-1] = f"{merged[-1]} {piece}"
+        else:
+            merged.append(piece)
+    return merged
+
+
+def _wrap(text: str, max_chars: int) -> list[str]:
+    if len(text) <= max_chars:
+        return [text] if text else []
+    lines, current = [], ""
+    for word in text.split():
+        if current and len(current) + len(word) + 1 > max_chars:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        lines.append(current)
+    return lines
@@ -0,0 +1,209 @@
+"""Dedicated inference worker for the TTS model.
+
+A single daemon thread owns every call into the model, so the asyncio loop
+never runs inference. Requests are queued per guild and served round-robin,
+which keeps one busy guild from starving the others. The queue is bounded and
+each request carries a deadline.
+
+Batched requests (``run_batched``) that arrive within a short window are
+handed to their handler together, so it can run a single forward pass.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class WorkerBusy(Exception):
+    """Raised when the worker queue is full."""
+
+
+class _Job:
+    __slots__ = ("guild_id", "fn", "args", "future", "deadline", "batched")
+
+    def __init__(
+        self,
+        guild_id: int,
+        fn: Callable,
+        args: tuple,
+        deadline: Optional[float],
+        batched: bool = False,
+    ):
+        self.guild_id = guild_id
+        self.fn = fn
+        self.args = args
+        self.future: Future = Future()
+        self.deadline = deadline
+        self.batched = batched
+
+    def start(self) -> bool:
+        """Marks the job running; False if it was cancelled or has expired."""
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.future.cancel()
+        return self.future.set_running_or_notify_cancel()
+
+
+class InferenceWorker:
+    """Single-thread executor with per-guild fairness and request timeouts."""
+
+    def __init__(
+        self,
+        name: str = "tts-inference",
+        max_pending: int = 32,
+        batch_window: float = 0.0,
+        max_batch: int = 1,
+    ):
+        self.max_pending = max_pending
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queues: dict[int, deque[_Job]] = {}
+        # Ordine round-robin delle gilde con richieste in attesa
+        self._order: deque[int] = deque()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, guild_id: int, fn: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """
+        Esegue ``fn(*args)`` sul thread di inferenza e ne attende il risultato.
+        Solleva WorkerBusy se la coda è piena e asyncio.TimeoutError se la
+        richiesta non termina entro ``timeout`` secondi.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        return await self._submit(_Job(guild_id, fn, args, deadline), timeout)
+
+    async def run_batched(
+        self,
+        guild_id: int,
+        handler: Callable[[list], list],
+        item: Any,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Accoda ``item`` per ``handler``, che riceve una lista di item raccolti
+        entro ``batch_window`` secondi (anche da gilde diverse) e restituisce
+        una lista di risultati nello stesso ordine. Un risultato che è
+        un'eccezione viene sollevato solo per il suo item.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        return await self._submit(_Job(guild_id, handler, (item,), deadline, batched=True), timeout)
+
+    async def _submit(self, job: _Job, timeout: Optional[float]) -> Any:
+        guild_id = job.guild_id
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Inference worker is closed")
+            if self._pending >= self.max_pending:
+                raise WorkerBusy(f"{self._pending} requests already queued")
+            queue = self._queues.setdefault(guild_id, deque())
+            if not queue:
+                self._order.append(guild_id)
+            queue.append(job)
+            self._pending += 1
+            self._cond.notify()
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job.future), timeout)
+        except asyncio.TimeoutError:
+            # Se non è ancora partita il worker la salterà; se è in corso il risultato viene scartato
+            job.future.cancel()
+            raise
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            for queue in self._queues.values():
+                for job in queue:
+                    job.future.cancel()
+            self._queues.clear()
+            self._order.clear()
+            self._pending = 0
+            self._cond.notify_all()
+
+    def _next_job(self) -> _Job:
+        """Pops the next job, rotating across guilds. Caller holds the lock."""
+        guild_id = self._order.popleft()
+        queue = self._queues[guild_id]
+        job = queue.popleft()
+        if queue:
+            self._order.append(guild_id)
+        else:
+            del self._queues[guild_id]
+        self._pending -= 1
+        return job
+
+    def _take_batchable(self, handler: Callable, limit: int) -> list[_Job]:
+        """
+        Pops queue heads batched for ``handler``, rotating across guilds.
+        Only heads are taken so each guild's requests stay in order.
+        Caller holds the lock.
+        """
+        taken: list[_Job] = []
+        for _ in range(len(self._order)):
+            if len(taken) >= limit:
+                break
+            guild_id = self._order[0]
+            head = self._queues[guild_id][0]
+            if head.batched and head.fn == handler:
+                taken.append(self._next_job())
+            else:
+                self._order.rotate(-1)
+        return taken
+
+    def _collect_batch(self, first: _Job) -> list[_Job]:
+        """Waits up to ``batch_window`` for more requests to batch with ``first``."""
+        batch = [first]
+        window_end = time.monotonic() + self.batch_window
+        with self._cond:
+            while len(batch) < self.max_batch and not self._closed:
+                batch += self._take_batchable(first.fn, self.max_batch - len(batch))
+                remaining = window_end - time.monotonic()
+                if len(batch) >= self.max_batch or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return batch
+
+    def _run_batch(self, jobs: list[_Job]) -> None:
+        jobs = [job for job in jobs if job.start()]
+        if not jobs:
+            return
+        try:
+            results = jobs[0].fn([job.args[0] for job in jobs])
+        except Exception as e:
+            results = [e] * len(jobs)
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                job.future.set_exception(result)
+            else:
+                job.future.set_result(result)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._order and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                job = self._next_job()
+
+            if job.batched:
+                self._run_batch(self._collect_batch(job) if self.max_batch > 1 else [job])
+                continue
+
+            if not job.start():
+                continue
+            try:
+                result = job.fn(*job.args)
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
@@ -2,25 +2,29 @@
 
 import asyncio
 import os
-import uuid
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
-from cogs import get_guild_dir, get_guild_json
+from typing import TYPE_CHECKING, Optional
+from cogs import BASE_DATA_DIR, get_guild_dir, lazy_import
+from cogs.core import store
+from cogs.audio import mixer
+from cogs.audio.loudness import analyze_pcm
+from cogs.audio.pcm import PCMAudioSource, StreamingAudioSource, pcm_duration, tensor_to_pcm
+from cogs.TTS.conditioning import ConditioningCache
+from cogs.TTS.cpu_mode import CPUSettings, configure_threads, inference_context, optimize_model
+from cogs.TTS import reference
+from cogs.TTS.phrase_cache import PhraseCache, model_version
+from cogs.TTS.text import split_sentences
+from cogs.TTS.worker import InferenceWorker, WorkerBusy
 import discord
-import torch
-import torchaudio as ta
 from discord import app_commands
 from discord.ext import commands
 
-import json
-
-# Import Chatterbox after ensuring proper initialization
-try:
+# torch e Chatterbox si importano in background in _async_init_model,
+# così il caricamento del cog non blocca l'avvio del bot
+if TYPE_CHECKING:
     from chatterbox.mtl_tts import ChatterboxMultilingualTTS
-except ImportError as e:
-    print(f"Error importing Chatterbox: {e}")
-    ChatterboxMultilingualTTS = None
 
 # Reference text mapping for voice cloning
 REF_TEXT_MAPPING = {
@@ -31,22 +35,61 @@ REF_TEXT_MAPPING = {
     "giorgio.wav": "Mi chiamo Giorgio.",
 }
 
+# Frase breve sintetizzata all'avvio per scaldare kernel, allocator e cache
+WARMUP_TEXT = "Ciao, sono pronto."
+
 
 class TTSCog(commands.Cog):
     """Cog for Text-to-Speech generation using Chatterbox."""
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model: Optional[ChatterboxMultilingualTTS] = None
+        # Rilevato in _async_init_model, dopo l'import di torch
+        self.device = "cpu"
+        self.model: Optional["ChatterboxMultilingualTTS"] = None
         self._model_lock = asyncio.Lock()
+        # loading -> warming -> ready (oppure failed); gli altri cog attendono self.ready
+        self.state = "loading"
+        self.ready = asyncio.Event()
+        self.warmup_speakers = int(os.getenv("TTS_WARMUP_SPEAKERS", "3"))
+        # Modalità prestazioni per i nodi senza GPU (TTS_CPU_MODE=fast)
+        self.cpu_settings = CPUSettings.from_env()
+        # Conditioning degli speaker già codificati (LRU + copia su disco)
+        self.conditioning = ConditioningCache(
+            max_entries=int(os.getenv("TTS_CONDS_CACHE_SIZE", "16"))
+        )
+        # Tutte le chiamate al modello passano da questo thread, mai dal loop.
+        # Le richieste già in coda vengono servite insieme; l'attesa di
+        # TTS_BATCH_WINDOW_MS si attiva solo se il modello ha generate_batch
+        self.batch_window = float(os.getenv("TTS_BATCH_WINDOW_MS", "30")) / 1000
+        self.worker = InferenceWorker(
+            max_pending=int(os.getenv("TTS_QUEUE_SIZE", "32")),
+            max_batch=int(os.getenv("TTS_MAX_BATCH", "4")),
+        )
+        self.request_timeout = float(os.getenv("TTS_TIMEOUT", "120"))
+        # Frasi già renderizzate (stesso speaker, testo, lingua e modello)
+        self.phrases = PhraseCache(
+            BASE_DATA_DIR / "tts_cache",
+            budget_bytes=int(os.getenv("TTS_PHRASE_CACHE_MB", "512")) * 1024 * 1024,
+        )
 
-        # FIX 1: Save the original torch.load BEFORE patching it
-        self.original_torch_load = torch.load
+        # FIX 1: the original torch.load is saved BEFORE patching it (see _async_init_model)
+        self.original_torch_load = None
 
         # Initialize model at startup
         self.bot.loop.create_task(self._async_init_model())
 
+    def cog_unload(self) -> None:
+        self.worker.close()
+
+    async def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Waits until the model is loaded and warmed up; False on timeout or failure."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.state == "ready"
+
     def log(self, message: str, level: str = "INFO") -> None:
         """Log messages with timestamp and emoji."""
         timestamp = datetime.now().strftime("%H:%M:%S")
@@ -63,6 +106,7 @@ class TTSCog(commands.Cog):
         print(f"[{timestamp}] {icon} [{level:<7}] -> {message}")
 
     def patched_torch_load(self, *args, **kwargs):
+        torch = lazy_import("torch")
         map_location = torch.device(self.device)
 
         # FIX 2: Use the saved original function, NOT torch.load
@@ -70,36 +114,48 @@ class TTSCog(commands.Cog):
             kwargs['map_location'] = map_location
         return self.original_torch_load(*args, **kwargs)
 
+    async def speaker_gain(self, guild_id: int, speaker: str, pcm: bytes) -> float:
+        """
+        Loudness normalization gain of a speaker, measured on its first
+        generated audio and then read from the metadata store.
+        """
+        gain = await store.gain(guild_id, "speakers", speaker, "tts")
+        if gain is not None:
+            return gain
+        if pcm_duration(pcm) < 1.0:
+            # Troppo corto per una misura affidabile: si misura alla prossima
+            return 1.0
+        gain = await asyncio.to_thread(analyze_pcm, pcm)
+        await store.set_gain(guild_id, "speakers", speaker, gain, "tts")
+        return gain
+
     async def get_speaker_name(self, filename, interaction : discord.Interaction) -> str :
-        speakers_json = await get_guild_json(interaction.guild_id, "speakers")
-        with open(speakers_json, "r", encoding="utf-8") as f:
-            current_speakers = json.load(f)
-        speaker_found = ""
-        for speaker, value in current_speakers.items() :
-            if value == filename :
-                speaker_found = speaker
-        return speaker_found
+        return await store.lookup_name(interaction.guild_id, "speakers", filename) or ""
 
     async def autocomplete_speakers(
             self,
             interaction : discord.Interaction,
             current : str,
     ) -> list[app_commands.Choice[str]]:
-        speakers_json = await get_guild_json(interaction.guild_id, "speakers")
-        with open(speakers_json, "r", encoding="utf-8") as f:
-            current_speakers = json.load(f)
-
-        return [app_commands.Choice(name=name, value=filename)
-            for name, filename in current_speakers.items()
-            if current.lower() in name.lower()][:25]
+        matches = await store.search(interaction.guild_id, "speakers", current)
+        return [app_commands.Choice(name=name, value=filename) for name, filename in matches]
 
     async def _async_init_model(self) -> None:
-        self.log(f"[TORCH] Usando il devoce {self.device}", "INFO")
         """Initialize the TTS model asynchronously."""
-        if ChatterboxMultilingualTTS is None:
-            self.log("ChatterboxMultilingualTTS not available", "ERROR")
+        # Import the ML stack off the loop: /ping and the other cogs stay responsive
+        try:
+            torch = await asyncio.to_thread(lazy_import, "torch")
+            await asyncio.to_thread(lazy_import, "chatterbox.mtl_tts")
+        except ImportError as e:
+            self.log(f"ChatterboxMultilingualTTS not available: {e}", "ERROR")
+            self.state = "failed"
+            self.ready.set()
             return
 
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.original_torch_load = torch.load
+        self.log(f"[TORCH] Usando il device {self.device}", "INFO")
+
         if self.device == "cpu":
             # Check for MPS (Mac) just in case, though logs say Linux
             if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
@@ -108,6 +164,11 @@ class TTSCog(commands.Cog):
             # Apply the patch
             torch.load = self.patched_torch_load
 
+        if self.device != "cpu":
+            self.cpu_settings.enabled = False
+        # Le frasi renderizzate dal modello quantizzato non valgono per quello pieno
+        self.phrases.version = f"{model_version()}{self.cpu_settings.variant}"
+
         try:
             self.log(f"Initializing TTS model on {self.device}...", "PROCESS")
             async with self._model_lock:
@@ -115,36 +176,256 @@ class TTSCog(commands.Cog):
                     None, self._init_model_sync
                 )
             self.log("TTS model initialized successfully", "SUCCESS")
+            if hasattr(self.model, "generate_batch"):
+                # Aspettare altre richieste conviene solo se vanno in un unico forward
+                self.worker.batch_window = self.batch_window
         except Exception as e:
             self.log(f"Failed to initialize model: {e}", "ERROR")
+            self.state = "failed"
+            self.ready.set()
+            return
+
+        self.state = "warming"
+        await self._warm_up()
+        self.state = "ready"
+        self.ready.set()
+        self.log("TTS ready", "SUCCESS")
+
+    async def _warm_up(self) -> None:
+        """
+        Synthesizes a short phrase for the most used speakers, filling their
+        conditioning cache, so the first real request runs at steady-state
+        latency. Without usage data the model's built-in voice is used.
+        """
+        started = time.perf_counter()
+        speakers = []
+        for guild_id, filename in await store.top_used("speakers", self.warmup_speakers):
+            path = BASE_DATA_DIR / str(guild_id) / "speakers" / filename
+            if not path.exists():
+                continue
+            try:
+                path = await asyncio.to_thread(reference.prepare, path)
+            except Exception as e:
+                self.log(f"Cannot decode speaker file {path}: {e}", "WARNING")
+                continue
+            speakers.append((guild_id, path))
+
+        try:
+            if not speakers:
+                await self.worker.run(0, self._warm_up_default)
+            for guild_id, path in speakers:
+                await self.worker.run(
+                    guild_id, self._synthesize_sync, WARMUP_TEXT, str(path), "it", guild_id
+                )
+        except Exception as e:
+            self.log(f"Warm-up failed: {e}", "WARNING")
+            return
+        self.log(
+            f"Warm-up done in {time.perf_counter() - started:.1f}s ({len(speakers)} speakers)",
+            "SUCCESS",
+        )
 
-    def _init_model_sync(self) -> ChatterboxMultilingualTTS:
+    def _warm_up_default(self) -> None:
+        """Runs on the inference worker with the conditioning shipped with the model."""
+        with inference_context(self.cpu_settings):
+            wav = self.model.generate(WARMUP_TEXT, language_id="it")
+        tensor_to_pcm(wav, self.model.sr)
+
+    def _init_model_sync(self) -> "ChatterboxMultilingualTTS":
         """Synchronous model initialization."""
-        return ChatterboxMultilingualTTS.from_pretrained(device=self.device)
+        if self.cpu_settings.enabled:
+            configure_threads(self.cpu_settings)
+        tts = lazy_import("chatterbox.mtl_tts")
+        model = tts.ChatterboxMultilingualTTS.from_pretrained(device=self.device)
+        if self.cpu_settings.enabled:
+            applied = optimize_model(model, self.cpu_settings)
+            self.log(
+                f"CPU mode ({self.cpu_settings.describe()}): {', '.join(applied) or 'threads only'}",
+                "INFO",
+            )
+        return model
+
+    def _synthesize_sync(
+        self,
+        text: str,
+        target_audio: str,
+        language: str,
+        guild_id: int,
+    ) -> bytes:
+        """Runs on the inference worker thread; returns 48 kHz stereo PCM."""
+        with inference_context(self.cpu_settings):
+            self.model.conds = self.conditioning.get(self.model, guild_id, Path(target_audio))
+            wav = self.model.generate(text, language_id=language)
+        return tensor_to_pcm(wav, self.model.sr)
+
+    async def render(
+        self,
+        guild_id: int,
+        text: str,
+        target_audio: str,
+        language: str,
+    ) -> bytes:
+        """Returns PCM for ``text``, from the phrase cache when possible."""
+        key = await asyncio.to_thread(self.phrases.key_for, Path(target_audio), text, language)
+        pcm = await asyncio.to_thread(self.phrases.get, key)
+        if pcm is not None:
+            self.log("Phrase cache hit", "INFO")
+            return pcm
+
+        started = time.perf_counter()
+        pcm = await self.worker.run_batched(
+            guild_id,
+            self._synthesize_batch,
+            (text, target_audio, language, guild_id),
+            timeout=self.request_timeout,
+        )
+        await asyncio.to_thread(self.phrases.put, key, pcm, time.perf_counter() - started)
+        return pcm
 
     async def generate_audio(
         self,
         text: str,
-        output_audio: str,
         target_audio: str,
         speaker_name: str,
-        language : str
-    ) -> bool:
-        """Generate audio from text using voice cloning."""
+        language : str,
+        guild_id: int,
+    ) -> Optional[bytes]:
+        """
+        Generate audio from text using voice cloning.
+
+        Returns 48 kHz stereo PCM ready for playback, or None on failure.
+        WorkerBusy and asyncio.TimeoutError are propagated so the caller can
+        tell the user to retry.
+        """
         try:
             self.log(f"Generating audio for speaker: {speaker_name}", "PROCESS")
 
-            # Run generation in executor to avoid blocking
-            wav = self.model.generate(text, audio_prompt_path=target_audio, language_id=language)
-
-            # Save the generated audio
-            ta.save(output_audio, wav, self.model.sr)
+            # Cached render or generation on the inference worker, never on the loop
+            pcm = await self.render(guild_id, text, target_audio, language)
             self.log(f"Audio generated successfully for {speaker_name}", "SUCCESS")
-            return True
+            return pcm
 
+        except (WorkerBusy, asyncio.TimeoutError):
+            raise
         except Exception as e:
             self.log(f"Error generating audio: {e}", "ERROR")
-            return False
+            return None
+
+    def _synthesize_batch(self, items: list[tuple]) -> list:
+        """
+        Batch handler for the inference worker.
+
+        Items are ``(text, target_audio, language, guild_id)``. Items sharing
+        speaker and language are generated together, so the conditioning is
+        swapped once per group; if the model exposes ``generate_batch`` the
+        group runs as a single forward pass, otherwise item by item.
+        """
+        results: list = [None] * len(items)
+        groups: dict[tuple, list[int]] = {}
+        for index, (_, target_audio, language, guild_id) in enumerate(items):
+            groups.setdefault((guild_id, target_audio, language), []).append(index)
+
+        with inference_context(self.cpu_settings):
+            self._generate_groups(items, groups, results)
+
+        if len(items) > 1:
+            self.log(f"Served {len(items)} requests in one batch ({len(groups)} voices)", "GPU")
+        return results
+
+    def _generate_groups(self, items: list[tuple], groups: dict, results: list) -> None:
+        generate_batch = getattr(self.model, "generate_batch", None)
+        for (guild_id, target_audio, language), indexes in groups.items():
+            try:
+                self.model.conds = self.conditioning.get(self.model, guild_id, Path(target_audio))
+            except Exception as e:
+                for index in indexes:
+                    results[index] = e
+                continue
+
+            if generate_batch is not None and len(indexes) > 1:
+                try:
+                    wavs = generate_batch([items[i][0] for i in indexes], language_id=language)
+                    for index, wav in zip(indexes, wavs):
+                        results[index] = tensor_to_pcm(wav, self.model.sr)
+                    continue
+                except Exception as e:
+                    self.log(f"Batched generation failed, falling back: {e}", "WARNING")
+
+            for index in indexes:
+                try:
+                    wav = self.model.generate(items[index][0], language_id=language)
+                    results[index] = tensor_to_pcm(wav, self.model.sr)
+                except Exception as e:
+                    results[index] = e
+
+    async def send_generation_error(self, interaction: discord.Interaction, error: Exception) -> None:
+        """Reports a failed generation to the user."""
+        if isinstance(error, WorkerBusy):
+            self.log(f"Inference queue full ({self.worker.pending} pending)", "WARNING")
+            await interaction.followup.send(
+                "⏳ Too many TTS requests right now, try again in a few seconds."
+            )
+        elif isinstance(error, asyncio.TimeoutError):
+            self.log(f"Generation timed out after {self.request_timeout:.0f}s", "WARNING")
+            await interaction.followup.send("⌛ TTS request timed out.")
+        else:
+            self.log(f"Error generating audio: {error}", "ERROR")
+            await interaction.followup.send(
+                "❌ Error creating audio. Try different text or speaker."
+            )
+
+    async def speak_streamed(
+        self,
+        interaction: discord.Interaction,
+        vc: discord.VoiceClient,
+        text: str,
+        sentences: list[str],
+        speaker: str,
+        speaker_path: Path,
+        speaker_name: str,
+        language: str,
+    ) -> None:
+        """Synthesizes sentence by sentence and starts playing after the first one."""
+        source = StreamingAudioSource()
+
+        def after_playback(error):
+            if error:
+                self.log(f"Playback error: {error}", "ERROR")
+            if source.underruns:
+                self.log(f"Stream underruns: {source.underruns} frames", "INFO")
+
+        started = False
+        for index, sentence in enumerate(sentences, start=1):
+            if source.closed:
+                self.log("Playback stopped, dropping remaining sentences", "INFO")
+                break
+            try:
+                pcm = await self.render(
+                    interaction.guild_id, sentence, str(speaker_path), language
+                )
+            except Exception as e:
+                if not started:
+                    await self.send_generation_error(interaction, e)
+                else:
+                    self.log(f"Sentence {index}/{len(sentences)} failed: {e}", "ERROR")
+                break
+
+            source.push(pcm)
+            self.log(f"Sentence {index}/{len(sentences)} ready", "AUDIO")
+            if started:
+                continue
+
+            started = True
+            try:
+                gain = await self.speaker_gain(interaction.guild_id, speaker, pcm)
+                mixer.play(vc, source, kind="voice", gain=gain, after=after_playback)
+                await interaction.followup.send(f"🗣️ **{speaker_name}**: {text}")
+            except Exception as e:
+                self.log(f"Playback error: {e}", "ERROR")
+                await interaction.followup.send(f"⚠️ Playback error: {e}")
+                break
+
+        source.finish()
 
     @app_commands.command(
         name="speak",
@@ -153,7 +434,8 @@ class TTSCog(commands.Cog):
     @app_commands.describe(
         testo="What should I say?",
         speaker="Which voice should speak?",
-        lang = "La Linuga"
+        lang = "La Linuga",
+        stream="Start speaking after the first sentence instead of the whole text",
     )
     @app_commands.autocomplete(speaker=autocomplete_speakers)
     @app_commands.choices(
@@ -166,9 +448,17 @@ class TTSCog(commands.Cog):
         interaction: discord.Interaction,
         testo: str,
         speaker: str,
-        lang : str = "it") :
+        lang : str = "it",
+        stream : bool = True) :
         """Generate and play TTS audio in a voice channel."""
         # Preliminary checks
+        if self.state in ("loading", "warming"):
+            await interaction.response.send_message(
+                "⏳ TTS is still starting up, try again in a moment.",
+                ephemeral=True,
+            )
+            return
+
         if self.model is None:
             await interaction.response.send_message(
                 "❌ TTS system is not ready. Check the console.",
@@ -199,6 +489,19 @@ class TTSCog(commands.Cog):
             )
             return
 
+        # Si condiziona sul clip di riferimento (silenzi tagliati, al più qualche secondo)
+        try:
+            speaker_path = await asyncio.to_thread(reference.prepare, speaker_path)
+        except Exception as e:
+            self.log(f"Cannot decode speaker file {speaker_path}: {e}", "ERROR")
+            await interaction.followup.send(
+                f"❌ Configuration error: file '{speaker}' cannot be decoded."
+            )
+            return
+
+        # Gli speaker più usati vengono scaldati al prossimo avvio
+        await store.record_use(interaction.guild_id, "speakers", speaker)
+
         # Voice connection management
         vc = interaction.guild.voice_client
         try:
@@ -216,49 +519,50 @@ class TTSCog(commands.Cog):
             return
 
         # Generate audio
-        file_out = f"tts_{uuid.uuid4()}.wav"
         testo_stripped = testo.strip()
         self.log(
             f"Starting generation: '{testo_stripped}' (speaker: {speaker_name})",
             "PROCESS",
         )
 
-        success = await self.generate_audio(
-            testo_stripped,
-            file_out,
-            str(speaker_path),
-            speaker_name,
-            language
-        )
+        sentences = split_sentences(testo_stripped)
+        if stream and len(sentences) > 1:
+            await self.speak_streamed(
+                interaction, vc, testo_stripped, sentences, speaker, speaker_path, speaker_name,
+                language,
+            )
+            return
 
-        if not success:
+        try:
+            pcm = await self.generate_audio(
+                testo_stripped,
+                str(speaker_path),
+                speaker_name,
+                language,
+                interaction.guild_id,
+            )
+        except (WorkerBusy, asyncio.TimeoutError) as e:
+            await self.send_generation_error(interaction, e)
+            return
+
+        if pcm is None:
             await interaction.followup.send(
                 "❌ Error creating audio. Try different text or speaker."
             )
             return
 
-        # Play audio
+        # Play audio (sopra eventuale musica, che viene abbassata)
         try:
-            if vc.is_playing():
-                vc.stop()
-
-            self.log(f"Playing file: {file_out}", "AUDIO")
-            source = discord.FFmpegPCMAudio(file_out)
+            self.log(f"Playing {pcm_duration(pcm):.1f}s of audio", "AUDIO")
+            source = PCMAudioSource(pcm)
 
             def after_playback(error):
                 """Callback executed after playback."""
                 if error:
                     self.log(f"Playback error: {error}", "ERROR")
 
-                # Clean up temporary file
-                try:
-                    if os.path.exists(file_out):
-                        os.remove(file_out)
-                        self.log(f"Temporary file removed: {file_out}", "INFO")
-                except Exception as e:
-                    self.log(f"File removal error: {e}", "WARNING")
-
-            vc.play(source, after=after_playback)
+            gain = await self.speaker_gain(interaction.guild_id, speaker, pcm)
+            mixer.play(vc, source, kind="voice", gain=gain, after=after_playback)
             await interaction.followup.send(
                 f"🗣️ **{speaker_name}**: {testo_stripped}"
             )
@@ -267,9 +571,23 @@ class TTSCog(commands.Cog):
             self.log(f"Playback error: {e}", "ERROR")
             await interaction.followup.send(f"⚠️ Playback error: {e}")
 
-            # Cleanup on error
-            if os.path.exists(file_out):
-                os.remove(file_out)
+    @app_commands.command(
+        name="tts-stats",
+        description="Show phrase cache statistics",
+    )
+    async def tts_stats(self, interaction: discord.Interaction) -> None:
+        """Report phrase cache hits, misses and saved inference time."""
+        stats = self.phrases.stats()
+        embed = discord.Embed(title="📊 TTS phrase cache", color=discord.Color.blue())
+        embed.add_field(name="Hits", value=str(stats["hits"]))
+        embed.add_field(name="Misses", value=str(stats["misses"]))
+        embed.add_field(name="Hit rate", value=f"{stats['hit_rate']:.0%}")
+        embed.add_field(name="Entries", value=str(stats["entries"]))
+        embed.add_field(
+            name="Disk", value=f"{stats['size_mb']:.1f} / {stats['budget_mb']:.0f} MB"
+        )
+        embed.add_field(name="Inference saved", value=f"{stats['saved_seconds']:.1f}s")
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @app_commands.command(
         name="leave",
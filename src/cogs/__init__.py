@@ -5,15 +5,44 @@ This module initializes the cogs system for the Discord bot.
 
 from discord.ext import commands
 import asyncio
+import importlib
+import sys
+import threading
+import time
 from pathlib import Path
 import json
 
 BASE_DATA_DIR = Path(__file__).parent.absolute() / "data"
 
+# Tempi (ms) degli import pesanti fatti con lazy_import, per il report di avvio
+IMPORT_TIMES: dict[str, float] = {}
+_import_lock = threading.Lock()
+
+def lazy_import(module: str):
+    """
+    Importa un modulo pesante (torch, chatterbox, fairseq...) al primo uso
+    e registra quanto ci ha messo. Thread-safe: si può chiamare da un executor.
+    """
+    if module in IMPORT_TIMES:
+        return sys.modules[module]
+    with _import_lock:
+        started = time.perf_counter()
+        loaded = importlib.import_module(module)
+        elapsed = (time.perf_counter() - started) * 1000
+        if module not in IMPORT_TIMES:
+            IMPORT_TIMES[module] = elapsed
+            print(f"[import] {module}: {elapsed:.0f} ms")
+    return loaded
+
+# Cartelle già create: evita mkdir ad ogni chiamata
+_created_dirs: set[Path] = set()
+
 async def get_guild_dir(guild_id: int, subfolder: str) -> Path:
     """Restituisce il percorso della sottocartella per un server specifico."""
     path = BASE_DATA_DIR / str(guild_id) / subfolder
-    path.mkdir(parents=True, exist_ok=True) # Crea la cartella se manca
+    if path not in _created_dirs:
+        path.mkdir(parents=True, exist_ok=True) # Crea la cartella se manca
+        _created_dirs.add(path)
     return path
 
 async def get_guild_json(guild_id: int, subfolder: str, json_name : str = "index.json") -> Path:
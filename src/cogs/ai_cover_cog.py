@@ -1,12 +1,13 @@
 import discord
 import os
-import torch
+import sys
 import asyncio
 from pathlib import Path
 from discord.ext import commands
 from discord import app_commands
-import json
 from cogs.RVC import rvc
+from cogs.audio import mixer
+from cogs.RVC.catalog import catalog
 
 CURRDIR = Path(__file__).parent.absolute()
 
@@ -15,12 +16,28 @@ class AICover(commands.Cog):
         self.bot = bot
         self.queue = asyncio.Queue()
         self.is_processing = False
+        # Cover in riproduzione per gilda (stream del mixer), per /skip
+        self.current_streams: dict[int, mixer.MixerStream] = {}
         self.worker_task = self.bot.loop.create_task(self.queue_worker())
+        # Importa lo stack RVC in background: la prima cover non paga l'import
+        self.bot.loop.create_task(self.preload_backend())
+
+    def cog_unload(self):
+        self.worker_task.cancel()
+        rvc.parallel.converter.shutdown()
+
+    async def preload_backend(self):
+        try:
+            await asyncio.to_thread(rvc.load_backend)
+            # Analizza subito i modelli nuovi: l'autocomplete non li aspetta
+            await catalog.models()
+            # Demucs resta caricato: la prima cover non paga i pesi
+            await asyncio.to_thread(rvc.separator.load)
+        except Exception as e:
+            print(f"Preload dello stack RVC fallito: {e}")
 
     async def open_models_list(self):
-        models_json = CURRDIR / "RVC" / "index.json"
-        with open(models_json, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return await catalog.models()
 
     async def vc_connect(self, interaction: discord.Interaction):
         if not interaction.user.voice:
@@ -42,8 +59,8 @@ class AICover(commands.Cog):
             return None
 
     async def model_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-        models = await self.open_models_list()
-        return [app_commands.Choice(name=name, value=filename) for name, filename in models.items() if current.lower() in name.lower()][:25]
+        matches = await catalog.search(current)
+        return [app_commands.Choice(name=name, value=filename) for name, filename in matches]
 
     @app_commands.command(name="ai-cover", description="crea una cover ai della tua canzone preferita")
     @app_commands.describe(url="il link del video youtube", model="da chi vuoi far cantare la canzone", pitch="Trasposizione Default 0")
@@ -75,6 +92,7 @@ class AICover(commands.Cog):
         }
 
         await self.queue.put(item)
+        catalog.touch(model)
         pos = self.queue.qsize()
         embed = discord.Embed(
             title=f"✅ In coda!",
@@ -108,26 +126,34 @@ class AICover(commands.Cog):
                 embed.add_field(name="Utente", value=f"{interaction.user.mention}")
                 await interaction.followup.send(embed=embed)
 
-                output_path = await rvc.ai_cover(interaction, model, url, pitch)
+                output_path, gain = await rvc.ai_cover(interaction, model, url, pitch)
 
                 if not os.path.exists(output_path):
                     raise FileNotFoundError(f"File audio non trovato.")
 
                 # 3. Riproduzione e Attesa
-                if vc.is_playing():
-                    vc.stop()
-
                 # Evento per capire quando la canzone finisce
                 play_done = asyncio.Event()
 
+                guild_id = interaction.guild_id
+
+                def finished():
+                    # Solo la cover di questa gilda, e solo se non è già stata sostituita
+                    if self.current_streams.get(guild_id) is stream:
+                        del self.current_streams[guild_id]
+                    play_done.set()
+
                 def after_playing(error):
                     if error:
                         print(f"Errore riproduzione: {error}")
                     # Segnala che la riproduzione è finita
-                    self.bot.loop.call_soon_threadsafe(play_done.set)
+                    self.bot.loop.call_soon_threadsafe(finished)
 
                 source = discord.FFmpegPCMAudio(output_path)
-                vc.play(source, after=after_playing)
+                stream = mixer.play(
+                    vc, source, kind="music", gain=gain, after=after_playing
+                )
+                self.current_streams[guild_id] = stream
 
                 embed = discord.Embed(
                     title="🎶Riproduzione in Corso!",
@@ -153,7 +179,8 @@ class AICover(commands.Cog):
                 except: pass
             finally:
                 # Pulizia GPU e segnalazione fine task
-                torch.cuda.empty_cache()
+                if "torch" in sys.modules:
+                    sys.modules["torch"].cuda.empty_cache()
                 self.queue.task_done()
 
     @app_commands.command(name="skip", description="Salta la canzone attualmente in riproduzione")
@@ -161,16 +188,18 @@ class AICover(commands.Cog):
             vc = interaction.guild.voice_client
 
             # 1. Controlla se il bot è connesso e sta riproducendo qualcosa
-            if not vc or not vc.is_playing():
+            stream = self.current_streams.get(interaction.guild_id)
+            if not vc or stream is None:
                 return await interaction.response.send_message("❌ Non c'è nessuna canzone in riproduzione al momento.", ephemeral=True)
 
             # 2. Controlla se l'utente è nello stesso canale vocale del bot
             if not interaction.user.voice or interaction.user.voice.channel.id != vc.channel.id:
                 return await interaction.response.send_message("❌ Devi essere nel mio stesso canale vocale per usare questo comando!", ephemeral=True)
 
-            # 3. Interrompi la riproduzione
+            # 3. Interrompi la riproduzione (solo la cover: TTS e suoni continuano)
             # Questo attiverà automaticamente la funzione 'after_playing' nel worker
-            vc.stop()
+            self.current_streams.pop(interaction.guild_id, None)
+            stream.stop()
             embed = discord.Embed(
                 title="⏭️ Canzone saltata! Passo alla prossima..",
                 color=discord.Color.blue()
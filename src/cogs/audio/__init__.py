@@ -0,0 +1,4 @@
+"""
+Audio support package.
+Discord AudioSource implementations and PCM helpers shared by the cogs.
+"""
@@ -0,0 +1,109 @@
+"""Integrated loudness (ITU-R BS.1770 / EBU R128) and playback gain.
+
+Loudness is measured once, when a clip is decoded or generated, and the
+resulting gain is applied by the mixer as a scalar multiply: playback never
+runs a ``loudnorm`` filter.
+
+- LOUDNESS_TARGET   target in LUFS (default: -16)
+- LOUDNESS_MAX_GAIN maximum boost in dB (default: 12)
+"""
+
+import math
+import os
+
+import numpy as np
+
+from cogs import lazy_import
+from cogs.audio.pcm import CHANNELS, SAMPLE_RATE
+
+TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET", "-16"))
+MAX_GAIN_DB = float(os.getenv("LOUDNESS_MAX_GAIN", "12"))
+# Gating BS.1770-4: blocchi da 400 ms con passo di 100 ms
+BLOCK_SECONDS = 0.4
+STEP_SECONDS = 0.1
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+
+def _k_weighting(sr: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    """The two K-weighting biquads (high shelf + high pass) for sample rate ``sr``."""
+    # Parametri dei filtri di riferimento (stessa derivazione di libebur128):
+    # a 48 kHz danno esattamente i coefficienti della BS.1770
+    fc, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * fc / sr)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = np.array([vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k]) / a0
+    shelf_a = np.array([a0, 2 * (k * k - 1), 1 - k / q + k * k]) / a0
+
+    fc, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * fc / sr)
+    a0 = 1 + k / q + k * k
+    high_b = np.array([1.0, -2.0, 1.0])
+    high_a = np.array([a0, 2 * (k * k - 1), 1 - k / q + k * k]) / a0
+    return [(shelf_b, shelf_a), (high_b, high_a)]
+
+
+def integrated_loudness(samples: np.ndarray, sr: int) -> float:
+    """
+    Gated loudness in LUFS of ``samples`` (float, shape (n,) or (n, channels),
+    full scale = 1.0). Returns -inf for silence.
+    """
+    signal = lazy_import("scipy.signal")
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    filtered = samples.astype(np.float64)
+    for b, a in _k_weighting(sr):
+        filtered = signal.lfilter(b, a, filtered, axis=0)
+
+    # Energia media di ogni blocco (tutti i canali con peso 1), via somme cumulative
+    energy = np.concatenate(([0.0], np.cumsum(np.sum(filtered ** 2, axis=1))))
+    block = int(BLOCK_SECONDS * sr)
+    step = int(STEP_SECONDS * sr)
+    if len(filtered) < block:
+        # Clip più corto di un blocco: misura sull'intera durata
+        starts, block = np.array([0]), len(filtered)
+    else:
+        starts = np.arange(0, len(filtered) - block + 1, step)
+    if block == 0:
+        return float("-inf")
+    z = (energy[starts + block] - energy[starts]) / block
+
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(z)
+    gated = z[loudness > ABSOLUTE_GATE]
+    if gated.size == 0:
+        return float("-inf")
+    relative = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+    with np.errstate(divide="ignore"):
+        gated = gated[-0.691 + 10 * np.log10(gated) > relative]
+    return -0.691 + 10 * math.log10(gated.mean())
+
+
+def playback_gain(lufs: float, peak: float) -> float:
+    """Linear gain that brings ``lufs`` to the target without clipping ``peak``."""
+    if not math.isfinite(lufs) or peak <= 0:
+        return 1.0
+    gain_db = min(TARGET_LUFS - lufs, MAX_GAIN_DB)
+    gain = 10 ** (gain_db / 20)
+    # Alzare il volume non deve portare il picco oltre il fondo scala
+    return min(gain, max(1.0, 0.99 / peak))
+
+
+def analyze(samples: np.ndarray, sr: int) -> float:
+    """Playback gain for float ``samples`` at ``sr``."""
+    if samples.size == 0:
+        return 1.0
+    return playback_gain(integrated_loudness(samples, sr), float(np.abs(samples).max()))
+
+
+def analyze_file(path) -> float:
+    """Playback gain for a raw 48 kHz stereo s16le file (PCM sidecar)."""
+    return analyze_pcm(np.fromfile(path, dtype=np.int16))
+
+
+def analyze_pcm(pcm) -> float:
+    """Playback gain for a 48 kHz stereo s16le buffer (bytes, mmap or memoryview)."""
+    samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1, CHANNELS)
+    return analyze(samples.astype(np.float32) / 32768.0, SAMPLE_RATE)
@@ -0,0 +1,244 @@
+"""Per-guild mixer: one long-lived AudioSource that plays many streams at once.
+
+Cogs submit streams (TTS voice, soundboard clips, covers) with ``play`` instead
+of calling ``vc.stop()`` + ``vc.play()``: sounds overlap, the player is not
+torn down on every switch, and music is ducked while someone is speaking.
+
+Each 20 ms frame the active streams are read, scaled by their gain and summed
+with NumPy, then clipped back to s16le. When nothing has played for
+``IDLE_FRAMES`` the mixer returns ``b""`` so the player stops sending audio;
+the next ``play`` starts it again.
+
+Stopping the player from outside (``vc.stop()``, disconnect) ends every
+stream; use ``MixerStream.stop`` to end just one.
+"""
+
+import asyncio
+import threading
+from typing import Callable, Optional, Union
+
+import discord
+import numpy as np
+
+from cogs.audio.pcm import CHANNELS, FRAME_SIZE, SILENCE
+
+SAMPLES_PER_FRAME = FRAME_SIZE // (2 * CHANNELS)
+# Guadagno della musica mentre qualcuno parla, e frame per arrivarci / tornare a 1
+DUCK_GAIN = 0.3
+DUCK_ATTACK_FRAMES = 5
+DUCK_RELEASE_FRAMES = 25
+# Silenzio tenuto prima di fermare il player (1 s)
+IDLE_FRAMES = 50
+
+KINDS = ("voice", "music", "sfx")
+
+
+class MixerStream:
+    """Handle of a stream submitted to a mixer."""
+
+    def __init__(self, source: discord.AudioSource, kind: str, gain: float,
+                 after: Optional[Callable[[Optional[Exception]], None]]):
+        if kind not in KINDS:
+            raise ValueError(f"Tipo di stream sconosciuto: {kind}")
+        self.source = source
+        self.kind = kind
+        self.gain = gain
+        self.after = after
+        self.stopped = False
+        self.finished = False
+
+    def stop(self) -> None:
+        """Removes the stream at the next frame (``after`` is still called)."""
+        self.stopped = True
+
+
+class _MixerOutput(discord.AudioSource):
+    """What the player actually plays: one per ``vc.play``, so a player that is
+    still shutting down cannot close the streams of the next one."""
+
+    def __init__(self, mixer: "GuildMixer"):
+        self.mixer = mixer
+        self.ended = False
+
+    def read(self) -> bytes:
+        return self.mixer._mix(self)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        self.mixer._stopped(self)
+
+
+class GuildMixer:
+    def __init__(self):
+        self._streams: list[MixerStream] = []
+        self._lock = threading.Lock()
+        self._output: Optional[_MixerOutput] = None
+        self._duck = 1.0
+        self._idle = 0
+        self._acc = np.zeros(SAMPLES_PER_FRAME * CHANNELS, dtype=np.float32)
+
+    @property
+    def streams(self) -> list[MixerStream]:
+        with self._lock:
+            return list(self._streams)
+
+    def active(self, kind: str) -> bool:
+        return any(stream.kind == kind for stream in self.streams)
+
+    def add(self, source: discord.AudioSource, kind: str = "sfx", gain: float = 1.0,
+            after: Optional[Callable[[Optional[Exception]], None]] = None) -> MixerStream:
+        stream = MixerStream(source, kind, gain, after)
+        with self._lock:
+            self._streams.append(stream)
+        return stream
+
+    def ensure_playing(self, vc: discord.VoiceClient) -> None:
+        """Starts the player on ``vc`` if it is not already playing this mixer. Call on the loop."""
+        current = vc.source if (vc.is_playing() or vc.is_paused()) else None
+        if current is not None:
+            if current is self._output and not current.ended:
+                return
+            if not isinstance(current, _MixerOutput):
+                # Sorgente estranea al mixer: la sostituiamo
+                vc.stop()
+            elif vc.is_playing():
+                # Il nostro player precedente sta ancora chiudendo: riprova tra un frame
+                asyncio.get_running_loop().call_later(0.02, self.ensure_playing, vc)
+                return
+
+        output = _MixerOutput(self)
+        self._output = output
+        try:
+            vc.play(output)
+        except discord.ClientException:
+            self._output = None
+            if not vc.is_connected():
+                self._close_streams()
+                return
+            asyncio.get_running_loop().call_later(0.02, self.ensure_playing, vc)
+
+    # --- Thread del player -------------------------------------------------
+
+    def _finish(self, stream: MixerStream, error: Optional[Exception] = None) -> None:
+        if stream.finished:
+            return
+        stream.finished = True
+        try:
+            stream.source.cleanup()
+        except Exception as e:
+            print(f"Errore cleanup stream: {e}")
+        if stream.after is not None:
+            try:
+                stream.after(error)
+            except Exception as e:
+                print(f"Errore nella callback after: {e}")
+
+    def _duck_ramp(self, target: float) -> Union[np.ndarray, float]:
+        if self._duck == target:
+            return target
+        frames = DUCK_ATTACK_FRAMES if target < self._duck else DUCK_RELEASE_FRAMES
+        step = (1.0 - DUCK_GAIN) / frames
+        start = self._duck
+        if target < start:
+            self._duck = max(target, start - step)
+        else:
+            self._duck = min(target, start + step)
+        # Rampa lineare dentro il frame: niente click sul cambio di volume
+        ramp = np.linspace(start, self._duck, SAMPLES_PER_FRAME, dtype=np.float32)
+        return np.repeat(ramp, CHANNELS)
+
+    def _mix(self, output: _MixerOutput) -> bytes:
+        with self._lock:
+            streams = list(self._streams)
+
+        frames: list[tuple[MixerStream, bytes]] = []
+        for stream in streams:
+            if stream.stopped:
+                self._finish(stream)
+                continue
+            try:
+                data = stream.source.read()
+            except Exception as e:
+                self._finish(stream, e)
+                continue
+            if not data:
+                self._finish(stream)
+                continue
+            if len(data) < FRAME_SIZE:
+                data += SILENCE[len(data):]
+            frames.append((stream, data))
+
+        with self._lock:
+            self._streams = [stream for stream in self._streams if not stream.finished]
+
+        voice = any(stream.kind == "voice" for stream, _ in frames)
+        duck = self._duck_ramp(DUCK_GAIN if voice else 1.0)
+
+        if not frames:
+            self._idle += 1
+            if self._idle <= IDLE_FRAMES:
+                return SILENCE
+            with self._lock:
+                # Uno stream aggiunto nel frattempo tiene vivo il player
+                if self._streams:
+                    return SILENCE
+                output.ended = True
+            self._idle = 0
+            return b""
+        self._idle = 0
+
+        if len(frames) == 1:
+            stream, data = frames[0]
+            gain = duck if stream.kind == "music" else 1.0
+            # Caso più comune: un solo stream a volume pieno, nessun calcolo
+            if stream.gain == 1.0 and isinstance(gain, float) and gain == 1.0:
+                return data
+
+        acc = self._acc
+        acc.fill(0.0)
+        for stream, data in frames:
+            samples = np.frombuffer(data, dtype=np.int16)
+            gain = np.float32(stream.gain)
+            if stream.kind == "music":
+                gain = gain * duck
+            acc += samples * gain
+        np.clip(acc, -32768.0, 32767.0, out=acc)
+        return acc.astype(np.int16).tobytes()
+
+    def _close_streams(self) -> None:
+        with self._lock:
+            streams, self._streams = self._streams, []
+        for stream in streams:
+            self._finish(stream)
+        self._duck = 1.0
+        self._idle = 0
+
+    def _stopped(self, output: _MixerOutput) -> None:
+        # Fine naturale (idle) o player vecchio: gli stream restano a chi viene dopo.
+        # Altrimenti (stop, disconnect) nessuno li leggerà più e vanno chiusi.
+        if output.ended or output is not self._output:
+            return
+        self._output = None
+        self._close_streams()
+
+
+_mixers: dict[int, GuildMixer] = {}
+
+
+def get_mixer(guild_id: int) -> GuildMixer:
+    mixer = _mixers.get(guild_id)
+    if mixer is None:
+        mixer = _mixers[guild_id] = GuildMixer()
+    return mixer
+
+
+def play(vc: discord.VoiceClient, source: discord.AudioSource, kind: str = "sfx",
+         gain: float = 1.0,
+         after: Optional[Callable[[Optional[Exception]], None]] = None) -> MixerStream:
+    """Submits ``source`` to the guild mixer of ``vc`` and makes sure it is playing."""
+    mixer = get_mixer(vc.guild.id)
+    stream = mixer.add(source, kind, gain, after)
+    mixer.ensure_playing(vc)
+    return stream
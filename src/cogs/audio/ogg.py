@@ -0,0 +1,171 @@
+"""Minimal Ogg Opus muxer/demuxer (RFC 7845) for passthrough recordings.
+
+Discord already sends Opus: storing the packets as they arrive costs no
+decode during capture and about a tenth of the disk of a 48 kHz stereo WAV.
+Packets are queued by the receive thread and paged out by a writer thread.
+"""
+
+import queue
+import struct
+import threading
+import zlib
+from typing import Iterator, Optional
+
+from cogs.audio.pcm import CHANNELS, SAMPLE_RATE
+
+# Pacchetti per pagina: ~1 s di audio a 20 ms per pacchetto
+PACKETS_PER_PAGE = 50
+# Pre-skip consigliato per l'encoder di Discord (libopus, 48 kHz)
+PRE_SKIP = 312
+
+
+def _crc_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def ogg_crc(data: bytes) -> int:
+    """CRC-32 of the Ogg framing (polynomial 0x04C11DB7, not reflected)."""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def packet_samples(packet: bytes) -> int:
+    """Duration of an Opus packet in 48 kHz samples, from its TOC byte (RFC 6716)."""
+    if not packet:
+        return 0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame = (480, 960, 1920, 2880)[config & 3]  # SILK: 10/20/40/60 ms
+    elif config < 16:
+        frame = (480, 960)[config & 1]  # Hybrid: 10/20 ms
+    else:
+        frame = (120, 240, 480, 960)[config & 3]  # CELT: 2.5/5/10/20 ms
+    code = toc & 3
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frame * frames
+
+
+class OggOpusWriter:
+    """Writes Opus packets to an Ogg file from a background thread."""
+
+    def __init__(self, path: str, channels: int = CHANNELS):
+        self.path = path
+        self.packets = 0
+        self.error: Optional[BaseException] = None
+        self._serial = zlib.crc32(path.encode())
+        self._sequence = 0
+        self._granule = 0
+        self._pending: list[bytes] = []
+        self._segments = 0
+        self._queue: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._file = open(path, "wb")
+        self._write_headers(channels)
+        self._thread = threading.Thread(target=self._run, name=f"ogg-writer-{path}", daemon=True)
+        self._thread.start()
+
+    def _page(self, packets: list[bytes], header_type: int, granule: int) -> bytes:
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+        header = struct.pack(
+            "<4sBBqIIIB", b"OggS", 0, header_type, granule,
+            self._serial, self._sequence, 0, len(lacing),
+        )
+        page = bytearray(header + lacing + b"".join(packets))
+        struct.pack_into("<I", page, 22, ogg_crc(page))
+        self._sequence += 1
+        return bytes(page)
+
+    def _write_headers(self, channels: int) -> None:
+        head = struct.pack("<8sBBHIhB", b"OpusHead", 1, channels, PRE_SKIP, SAMPLE_RATE, 0, 0)
+        vendor = b"DriftBot"
+        tags = struct.pack("<8sI", b"OpusTags", len(vendor)) + vendor + struct.pack("<I", 0)
+        # Prima pagina con il flag beginning-of-stream
+        self._file.write(self._page([head], 0x02, 0))
+        self._file.write(self._page([tags], 0x00, 0))
+
+    # --- Thread di ricezione -------------------------------------------------
+
+    def push(self, packet: bytes) -> None:
+        if packet:
+            self._queue.put(packet)
+
+    def close(self) -> None:
+        self._queue.put(None)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    # --- Thread di scrittura -------------------------------------------------
+
+    def _flush(self, last: bool) -> None:
+        if not self._pending and not last:
+            return
+        self._file.write(self._page(self._pending, 0x04 if last else 0x00, self._granule))
+        self._pending = []
+        self._segments = 0
+
+    def _run(self) -> None:
+        try:
+            while True:
+                packet = self._queue.get()
+                if packet is None:
+                    break
+                # Una pagina può contenere al massimo 255 valori di lacing
+                segments = len(packet) // 255 + 1
+                if self._segments + segments > 255:
+                    self._flush(last=False)
+                # La granule position di una pagina è quella dell'ultimo pacchetto che chiude
+                self._pending.append(packet)
+                self._segments += segments
+                self._granule += packet_samples(packet)
+                self.packets += 1
+                if len(self._pending) >= PACKETS_PER_PAGE:
+                    self._flush(last=False)
+            self._flush(last=True)
+        except BaseException as e:
+            self.error = e
+            print(f"Errore scrittura registrazione ({self.path}): {e}")
+        finally:
+            self._file.close()
+
+
+def read_packets(path: str) -> Iterator[bytes]:
+    """Opus audio packets of an Ogg file (header packets skipped)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset, index, partial = 0, 0, b""
+    while offset + 27 <= len(data):
+        if data[offset:offset + 4] != b"OggS":
+            raise ValueError(f"{path}: pagina Ogg non valida all'offset {offset}")
+        segments = data[offset + 26]
+        lacing = data[offset + 27:offset + 27 + segments]
+        body = offset + 27 + segments
+        for value in lacing:
+            partial += data[body:body + value]
+            body += value
+            if value < 255:
+                # I primi due pacchetti sono OpusHead e OpusTags
+                if index >= 2:
+                    yield partial
+                index += 1
+                partial = b""
+        offset = body
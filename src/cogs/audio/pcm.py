@@ -0,0 +1,143 @@
+"""PCM helpers and in-memory AudioSources.
+
+Discord wants 20 ms frames of 48 kHz stereo signed 16-bit little-endian PCM.
+These helpers convert model output to that format in-process and serve it
+from memory, without temp files or an ffmpeg process.
+"""
+
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import discord
+
+from cogs import lazy_import
+
+if TYPE_CHECKING:
+    import torch
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+# 20 ms * 48000 Hz * 2 canali * 2 byte
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+SILENCE = b"\x00" * FRAME_SIZE
+
+
+@lru_cache(maxsize=8)
+def _resampler(orig_sr: int):
+    # Il kernel di resampling si calcola una volta sola per sample rate
+    torchaudio = lazy_import("torchaudio")
+    return torchaudio.transforms.Resample(orig_sr, SAMPLE_RATE)
+
+
+def tensor_to_pcm(wav: "torch.Tensor", sr: int) -> bytes:
+    """Converts a (channels, samples) float tensor at ``sr`` to 48 kHz stereo s16le."""
+    torch = lazy_import("torch")
+    wav = wav.detach().float().cpu()
+    if wav.dim() == 1:
+        wav = wav.unsqueeze(0)
+    if sr != SAMPLE_RATE:
+        wav = _resampler(sr)(wav)
+    if wav.shape[0] == 1:
+        wav = wav.expand(CHANNELS, -1)
+    else:
+        wav = wav[:CHANNELS]
+    samples = (wav.clamp(-1.0, 1.0) * 32767.0).to(torch.int16)
+    # (channels, samples) -> campioni interleaved L R L R ...
+    return samples.t().contiguous().numpy().tobytes()
+
+
+def pcm_duration(pcm: bytes) -> float:
+    """Duration in seconds of a 48 kHz stereo s16le buffer."""
+    return len(pcm) / (SAMPLE_RATE * CHANNELS * 2)
+
+
+class PCMAudioSource(discord.AudioSource):
+    """Serves 20 ms frames from an in-memory 48 kHz stereo PCM buffer."""
+
+    def __init__(self, pcm: bytes):
+        self._buffer = memoryview(pcm)
+        self._offset = 0
+
+    def read(self) -> bytes:
+        frame = self._buffer[self._offset:self._offset + FRAME_SIZE]
+        self._offset += FRAME_SIZE
+        if not frame:
+            return b""
+        if len(frame) < FRAME_SIZE:
+            return bytes(frame) + SILENCE[len(frame):]
+        return bytes(frame)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        self._buffer = memoryview(b"")
+
+
+class StreamingAudioSource(discord.AudioSource):
+    """
+    AudioSource fed incrementally with PCM segments.
+
+    Playback can start as soon as the first segment is pushed. If the player
+    catches up with the producer it gets silence frames (counted in
+    ``underruns``) until the next segment arrives or ``finish`` is called.
+    """
+
+    def __init__(self):
+        self._segments: deque[bytes] = deque()
+        self._offset = 0
+        self._available = 0
+        self._finished = False
+        self._lock = threading.Lock()
+        self.closed = False
+        self.underruns = 0
+
+    def push(self, pcm: bytes) -> None:
+        if not pcm:
+            return
+        with self._lock:
+            if self._finished:
+                return
+            self._segments.append(pcm)
+            self._available += len(pcm)
+
+    def finish(self) -> None:
+        """No more segments will be pushed; the source ends once drained."""
+        with self._lock:
+            self._finished = True
+
+    def read(self) -> bytes:
+        with self._lock:
+            if self._available < FRAME_SIZE and not self._finished:
+                self.underruns += 1
+                return SILENCE
+            if not self._available:
+                return b""
+
+            out = bytearray()
+            while len(out) < FRAME_SIZE and self._segments:
+                segment = self._segments[0]
+                take = segment[self._offset:self._offset + FRAME_SIZE - len(out)]
+                out += take
+                self._offset += len(take)
+                if self._offset >= len(segment):
+                    self._segments.popleft()
+                    self._offset = 0
+            self._available -= len(out)
+
+        if len(out) < FRAME_SIZE:
+            out += SILENCE[len(out):]
+        return bytes(out)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        # Chiamato dal player (stop, skip, disconnect): il producer smette di generare
+        with self._lock:
+            self.closed = True
+            self._finished = True
+            self._segments.clear()
+            self._available = 0
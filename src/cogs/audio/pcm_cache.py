@@ -0,0 +1,105 @@
+"""Decoded PCM sidecars for short clips (soundboard).
+
+Each clip is decoded once by ffmpeg to raw 48 kHz stereo s16le and stored next
+to it in a ``.pcm`` folder as ``<file>.<mtime_ns>.<size>.pcm``. Playback maps
+the sidecar into memory and slices frames out of it, so a trigger spawns no
+process and decodes nothing. Editing or replacing the source file changes its
+mtime/size, which points to a new sidecar; the stale one is removed on decode.
+"""
+
+import mmap
+import os
+import subprocess
+import threading
+from pathlib import Path
+
+import discord
+
+from cogs.audio.pcm import FRAME_SIZE, SILENCE
+
+SIDECAR_DIR = ".pcm"
+
+
+class MmapPCMSource(discord.AudioSource):
+    """Serves 20 ms frames straight from a memory-mapped PCM sidecar."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # mmap di un file vuoto non è permesso
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._map) if self._map is not None else memoryview(b"")
+        self._offset = 0
+
+    def read(self) -> bytes:
+        frame = self._view[self._offset:self._offset + FRAME_SIZE]
+        self._offset += FRAME_SIZE
+        if not frame:
+            return b""
+        # L'encoder opus vuole bytes: una copia di 3840 byte dalla page cache
+        if len(frame) < FRAME_SIZE:
+            return bytes(frame) + SILENCE[len(frame):]
+        return bytes(frame)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self) -> None:
+        self._view = memoryview(b"")
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Una vista è ancora viva: la mappa si chiude quando viene raccolta
+                pass
+            self._map = None
+
+
+class PCMCache:
+    """Decodes clips to PCM sidecars on demand (thread-safe, one decode per file)."""
+
+    def __init__(self, ffmpeg: str = "ffmpeg"):
+        self.ffmpeg = ffmpeg
+        self._locks: dict[Path, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    @staticmethod
+    def sidecar_path(source: Path) -> Path:
+        stat = source.stat()
+        return source.parent / SIDECAR_DIR / f"{source.name}.{stat.st_mtime_ns}.{stat.st_size}.pcm"
+
+    def _lock(self, source: Path) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(source, threading.Lock())
+
+    def ensure(self, source: Path) -> Path:
+        """Sidecar for ``source``, decoding it if missing or stale. Sync: run off the loop."""
+        sidecar = self.sidecar_path(source)
+        if sidecar.exists():
+            return sidecar
+        with self._lock(source):
+            if sidecar.exists():
+                return sidecar
+            sidecar.parent.mkdir(exist_ok=True)
+            tmp = sidecar.with_suffix(".tmp")
+            result = subprocess.run(
+                [self.ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", str(source),
+                 "-f", "s16le", "-ar", "48000", "-ac", "2", str(tmp)],
+                capture_output=True,
+            )
+            if result.returncode != 0:
+                tmp.unlink(missing_ok=True)
+                raise RuntimeError(
+                    f"ffmpeg non riesce a decodificare {source.name}: "
+                    f"{result.stderr.decode(errors='replace').strip()}"
+                )
+            os.replace(tmp, sidecar)
+            self._remove_stale(source, sidecar)
+        return sidecar
+
+    @staticmethod
+    def _remove_stale(source: Path, current: Path) -> None:
+        for old in current.parent.glob(f"{source.name}.*.pcm"):
+            if old != current and old.name.rsplit(".", 3)[0] == source.name:
+                old.unlink(missing_ok=True)
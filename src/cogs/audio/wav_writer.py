@@ -0,0 +1,242 @@
+"""Buffered WAV writer for voice recordings.
+
+The voice-receive thread only copies each 20 ms packet into a preallocated
+ring buffer; a dedicated writer thread drains it in large blocks, converts
+them and writes the WAV. A slow disk therefore never stalls packet reception:
+if the ring fills up, packets are dropped and counted instead.
+
+The writer also accepts raw Opus packets (``push_opus``) for sessions that
+receive Opus: they are queued as they are and decoded in the writer thread,
+with packet-loss concealment for gaps in the RTP sequence.
+
+Recordings are stored directly in the format the TTS model loads reference
+audio at (mono, ``TTS_SAMPLE_RATE``): downmix and resampling run once, here,
+with a filter state carried across blocks, not at every /speak.
+"""
+
+import threading
+import time
+import wave
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from cogs import lazy_import
+from cogs.audio.pcm import CHANNELS, SAMPLE_RATE
+
+# Sample rate a cui Chatterbox carica l'audio di riferimento (S3GEN_SR)
+TTS_SAMPLE_RATE = 24000
+# 10 s di audio 48 kHz stereo: margine ampio anche per un disco lento
+RING_SECONDS = 10.0
+# Il writer scrive quando ha almeno mezzo secondo, o ogni FLUSH_INTERVAL
+FLUSH_SECONDS = 0.5
+FLUSH_INTERVAL = 0.5
+# Un frame che aspetta più di così nel buffer è contato come in ritardo
+LATE_SECONDS = 1.0
+
+# Pacchetti persi ricostruiti dal decoder (PLC); oltre, silenzio
+MAX_CONCEALED_FRAMES = 5
+# Un salto di sequenza più grande è un pacchetto arrivato fuori ordine
+MAX_SEQUENCE_GAP = 1000
+
+_BYTES_PER_SECOND = SAMPLE_RATE * CHANNELS * 2
+_FRAMES_PER_SECOND = 50
+
+
+class Downsampler:
+    """Stereo 48 kHz s16le -> mono ``rate`` int16, stateful across blocks."""
+
+    def __init__(self, rate: int):
+        self.factor = SAMPLE_RATE // rate
+        self._phase = 0
+        self._taps = None
+        self._state = None
+        if self.factor > 1:
+            signal = lazy_import("scipy.signal")
+            # Passa-basso anti-aliasing al 90% della nuova Nyquist
+            self._taps = signal.firwin(63, 0.9 * rate / 2, fs=SAMPLE_RATE)
+            self._state = np.zeros(len(self._taps) - 1)
+
+    def __call__(self, pcm: bytes) -> bytes:
+        samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1, CHANNELS)
+        mono = samples.astype(np.float32).mean(axis=1)
+        if self.factor == 1:
+            return mono.astype(np.int16).tobytes()
+        signal = lazy_import("scipy.signal")
+        filtered, self._state = signal.lfilter(self._taps, 1.0, mono, zi=self._state)
+        out = filtered[self._phase::self.factor]
+        # Da dove riprendere la decimazione nel blocco successivo
+        self._phase = (self._phase - len(mono)) % self.factor
+        return np.clip(np.round(out), -32768, 32767).astype(np.int16).tobytes()
+
+
+class BufferedWavWriter:
+    """Ring buffer + writer thread producing a mono WAV at ``sample_rate``."""
+
+    def __init__(self, path: str, sample_rate: int = TTS_SAMPLE_RATE,
+                 ring_seconds: float = RING_SECONDS):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+
+        self._ring = bytearray(int(ring_seconds * _BYTES_PER_SECOND))
+        self._head = 0  # prossimo byte da scrivere su disco
+        self._size = 0  # byte in attesa nel buffer
+        self._times: deque[tuple[float, int]] = deque()  # (arrivo, byte) per frame
+        # Pacchetti Opus in attesa di decodifica: (arrivo, sequenza, pacchetto)
+        self._packets: deque[tuple[float, Optional[int], bytes]] = deque()
+        self._max_packets = int(ring_seconds * _FRAMES_PER_SECOND)
+        self._flush_packets = max(1, int(FLUSH_SECONDS * _FRAMES_PER_SECOND))
+        self._decoder = None
+        self._last_sequence: Optional[int] = None
+        self._flush_bytes = min(int(FLUSH_SECONDS * _BYTES_PER_SECOND), len(self._ring) // 2)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closing = False
+        self.error: Optional[BaseException] = None
+
+        if SAMPLE_RATE % sample_rate:
+            raise ValueError(f"Sample rate non supportato: {sample_rate} (deve dividere {SAMPLE_RATE})")
+        self._file = wave.open(path, "wb")
+        self._file.setnchannels(1)
+        self._file.setsampwidth(2)
+        self._file.setframerate(sample_rate)
+        self._thread = threading.Thread(
+            target=self._run, name=f"wav-writer-{path}", daemon=True
+        )
+        self._thread.start()
+
+    # --- Thread di ricezione: solo una copia in memoria ---------------------
+
+    def push(self, pcm: bytes) -> None:
+        """Queues one packet of 48 kHz stereo s16le. Never blocks on disk."""
+        n = len(pcm)
+        with self._lock:
+            if self._closing:
+                return
+            capacity = len(self._ring)
+            if self._size + n > capacity:
+                self.dropped += 1
+                return
+            tail = (self._head + self._size) % capacity
+            first = min(n, capacity - tail)
+            self._ring[tail:tail + first] = pcm[:first]
+            if first < n:
+                self._ring[:n - first] = pcm[first:]
+            self._size += n
+            self.frames += 1
+            self._times.append((time.monotonic(), n))
+            if self._size >= self._flush_bytes:
+                self._wakeup.notify()
+
+    def push_opus(self, packet: bytes, sequence: Optional[int] = None) -> None:
+        """Queues one Opus packet (RTP ``sequence`` if known). Never decodes here."""
+        with self._lock:
+            if self._closing:
+                return
+            if len(self._packets) >= self._max_packets:
+                self.dropped += 1
+                return
+            self._packets.append((time.monotonic(), sequence, bytes(packet)))
+            self.frames += 1
+            if len(self._packets) >= self._flush_packets:
+                self._wakeup.notify()
+
+    # --- Thread di scrittura ------------------------------------------------
+
+    def _take_packets(self) -> list[tuple[Optional[int], bytes]]:
+        """Queued Opus packets (called with the lock held)."""
+        now, packets = time.monotonic(), []
+        while self._packets:
+            arrived, sequence, packet = self._packets.popleft()
+            if now - arrived > LATE_SECONDS:
+                self.late += 1
+            packets.append((sequence, packet))
+        return packets
+
+    def _decode(self, packets: list[tuple[Optional[int], bytes]]) -> bytes:
+        if self._decoder is None:
+            import discord
+            self._decoder = discord.opus.Decoder()
+        pcm = bytearray()
+        for sequence, packet in packets:
+            if sequence is not None and self._last_sequence is not None:
+                gap = (sequence - self._last_sequence - 1) & 0xFFFF
+                if gap > MAX_SEQUENCE_GAP:
+                    # Duplicato o fuori ordine: ormai è passato
+                    continue
+                concealed = min(gap, MAX_CONCEALED_FRAMES)
+                for _ in range(concealed):
+                    pcm += self._decoder.decode(None)
+                frame_bytes = SAMPLE_RATE // _FRAMES_PER_SECOND * CHANNELS * 2
+                pcm += bytes(frame_bytes * (gap - concealed))
+            if sequence is not None:
+                self._last_sequence = sequence
+            pcm += self._decoder.decode(packet)
+        return bytes(pcm)
+
+
+    def _take(self) -> bytes:
+        """Everything currently buffered (called with the lock held)."""
+        capacity = len(self._ring)
+        end = self._head + self._size
+        if end <= capacity:
+            block = bytes(self._ring[self._head:end])
+        else:
+            block = bytes(self._ring[self._head:]) + bytes(self._ring[:end - capacity])
+        self._head = end % capacity
+        self._size = 0
+
+        now, taken = time.monotonic(), 0
+        while self._times and taken < len(block):
+            arrived, n = self._times.popleft()
+            taken += n
+            if now - arrived > LATE_SECONDS:
+                self.late += 1
+        return block
+
+    def _run(self) -> None:
+        try:
+            # Creato qui: l'import di scipy non pesa sul thread che avvia la registrazione
+            convert = Downsampler(self.sample_rate)
+            while True:
+                with self._lock:
+                    if (not self._closing and self._size < self._flush_bytes
+                            and len(self._packets) < self._flush_packets):
+                        self._wakeup.wait(FLUSH_INTERVAL)
+                    closing = self._closing
+                    block = self._take() if self._size else b""
+                    packets = self._take_packets() if self._packets else []
+                if packets:
+                    block += self._decode(packets)
+                if block:
+                    self._file.writeframes(convert(block))
+                if closing:
+                    break
+        except BaseException as e:
+            self.error = e
+            print(f"Errore scrittura registrazione ({self.path}): {e}")
+        finally:
+            try:
+                self._file.close()
+            except Exception as e:
+                print(f"Errore durante la chiusura del file: {e}")
+
+    def close(self, wait: bool = False) -> None:
+        """Flushes what is buffered and closes the file (in the writer thread)."""
+        with self._lock:
+            self._closing = True
+            self._wakeup.notify()
+        if wait:
+            self.join()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the file to be complete; True if it is."""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def stats(self) -> dict:
+        return {"frames": self.frames, "dropped": self.dropped, "late": self.late}
@@ -0,0 +1,18 @@
+"""
+Core package.
+Shared metadata used by several cogs: the SQLite store for per-guild speakers,
+aliases and soundboard sounds, the in-memory registry of the remaining JSON
+indexes and the search index behind autocomplete.
+"""
+
+from cogs.core.registry import IndexRegistry, registry
+from cogs.core.search import SearchIndex
+from cogs.core.store import MetadataStore, store
+
+__all__ = [
+    "IndexRegistry",
+    "MetadataStore",
+    "registry",
+    "SearchIndex",
+    "store",
+]
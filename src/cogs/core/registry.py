@@ -0,0 +1,158 @@
+"""In-memory registry of the JSON index files.
+
+Autocomplete runs on every keystroke. Instead of ``mkdir`` + ``open`` +
+``json.load`` each time, every index is loaded once and served from memory.
+An index is re-read when its file changes on disk (checked at most every
+``STAT_INTERVAL`` seconds, so hand edits are still picked up) and is updated
+in place by writes made through the registry.
+"""
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from cogs.core.search import SearchIndex
+
+
+class _Index:
+    __slots__ = ("data", "mtime_ns", "checked_at", "_reverse")
+
+    def __init__(self, data: dict, mtime_ns: int):
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.checked_at = time.monotonic()
+        self._reverse: Optional[dict] = None
+
+    @property
+    def reverse(self) -> dict:
+        """value -> key, built on first use."""
+        if self._reverse is None:
+            self._reverse = {value: key for key, value in self.data.items()}
+        return self._reverse
+
+
+class IndexRegistry:
+    """
+    Cache of JSON index files keyed by path.
+
+    The dicts returned by ``load`` are shared and must not be modified:
+    changes go through ``update``, which writes the file and swaps in a new dict.
+    """
+
+    STAT_INTERVAL = 2.0
+
+    def __init__(self):
+        self._indexes: dict[Path, _Index] = {}
+        self._locks: dict[Path, asyncio.Lock] = {}
+        # Indici di ricerca per l'autocomplete, creati alla prima ricerca
+        self._search: dict[Path, SearchIndex] = {}
+
+    def _lock(self, path: Path) -> asyncio.Lock:
+        return self._locks.setdefault(path, asyncio.Lock())
+
+    @staticmethod
+    def _mtime(path: Path) -> int:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _read(path: Path) -> tuple[dict, int]:
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f), mtime_ns
+        except FileNotFoundError:
+            return {}, 0
+        except ValueError as e:
+            print(f"Indice JSON non valido ({path}): {e}")
+            return {}, IndexRegistry._mtime(path)
+
+    @staticmethod
+    def _write(path: Path, data: dict) -> int:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, path)
+        return path.stat().st_mtime_ns
+
+    def _publish(self, path: Path, index: _Index) -> None:
+        self._indexes[path] = index
+        search = self._search.get(path)
+        if search is not None:
+            # Aggiornamento incrementale: solo le voci aggiunte, rinominate o rimosse
+            search.sync(index.data)
+
+    def _fresh(self, path: Path) -> Optional[_Index]:
+        """The cached index if it is still valid, without blocking I/O in the common case."""
+        index = self._indexes.get(path)
+        if index is None:
+            return None
+        now = time.monotonic()
+        if now - index.checked_at < self.STAT_INTERVAL:
+            return index
+        if self._mtime(path) != index.mtime_ns:
+            return None
+        index.checked_at = now
+        return index
+
+    async def _get(self, path: Path) -> _Index:
+        index = self._fresh(path)
+        if index is not None:
+            return index
+        async with self._lock(path):
+            index = self._fresh(path)
+            if index is None:
+                data, mtime_ns = await asyncio.to_thread(self._read, path)
+                index = _Index(data, mtime_ns)
+                self._publish(path, index)
+        return index
+
+    async def load(self, path: Path) -> dict:
+        """Contents of the index at ``path`` (empty if the file does not exist)."""
+        return (await self._get(path)).data
+
+    async def lookup_key(self, path: Path, value: Any) -> Optional[str]:
+        """Reverse lookup: the key mapped to ``value``, or None."""
+        return (await self._get(path)).reverse.get(value)
+
+    async def update(self, path: Path, mutate: Callable[[dict], Any]) -> Any:
+        """
+        Applies ``mutate`` to a copy of the index, writes it and publishes it.
+        Writes to the same file are serialized; returns what ``mutate`` returns.
+        """
+        async with self._lock(path):
+            index = self._fresh(path)
+            if index is None:
+                data, mtime_ns = await asyncio.to_thread(self._read, path)
+                index = _Index(data, mtime_ns)
+            data = dict(index.data)
+            result = mutate(data)
+            mtime_ns = await asyncio.to_thread(self._write, path, data)
+            self._publish(path, _Index(data, mtime_ns))
+        return result
+
+    async def search(self, path: Path, query: str, limit: int = 25) -> list[tuple[str, str]]:
+        """Ranked (name, value) matches for ``query`` in the index at ``path``."""
+        index = await self._get(path)
+        search = self._search.get(path)
+        if search is None:
+            search = self._search[path] = SearchIndex(index.data)
+        return search.search(query, limit)
+
+    def touch(self, path: Path, value: Any) -> None:
+        """Records a use of the entry mapped to ``value`` (autocomplete ranking)."""
+        index = self._indexes.get(path)
+        search = self._search.get(path)
+        if index is not None and search is not None:
+            name = index.reverse.get(value)
+            if name is not None:
+                search.touch(name)
+
+
+registry = IndexRegistry()
@@ -0,0 +1,262 @@
+"""Autocomplete search index: prefix lookup + trigram matching.
+
+Results are ranked in tiers:
+
+0. the name starts with the query
+1. a word inside the name starts with the query (``big_bob`` for ``bob``)
+2. fuzzy trigram match (typos, substrings)
+
+Within a tier, more used and more recently used entries come first, then
+shorter names. The index is updated incrementally (add / remove / sync), so
+adding a sound does not rebuild the whole structure.
+
+The prefix trie is kept flattened as a sorted list of keys: a prefix is a
+contiguous range found with ``bisect``, which walks no nodes and stays
+compact at 100k entries.
+"""
+
+import bisect
+import heapq
+import math
+import re
+import time
+from collections import Counter
+from typing import Optional
+
+_WORD = re.compile(r"[^\s_\-.]+")
+# Quante completazioni del prefisso esaminare al massimo prima del ranking
+MAX_PREFIX_CANDIDATES = 512
+# Voci più usate che restano candidate anche oltre il limite del range
+MAX_POPULAR = 64
+MIN_SIMILARITY = 0.3
+
+
+def _normalize(text: str) -> str:
+    return text.casefold().strip()
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Name -> value index with ranked prefix and fuzzy lookups."""
+
+    def __init__(self, entries: Optional[dict] = None):
+        # (chiave, tier, nome) ordinati: tier 0 nome intero, 1 parola interna
+        self._keys: list[tuple[str, int, str]] = []
+        self._trigrams: dict[str, set[str]] = {}
+        self._values: dict[str, str] = {}
+        # Più nomi possono puntare allo stesso valore (stesso file)
+        self._names: dict[str, set[str]] = {}
+        self.popularity: Counter[str] = Counter()
+        self.last_used: dict[str, float] = {}
+        # Le MAX_POPULAR voci più usate con le loro chiavi, ricalcolate dopo un uso
+        self._popular: Optional[list[tuple[str, list[tuple[str, int]]]]] = None
+        # Risultati per la query vuota, invalidati ad ogni modifica
+        self._default: Optional[list[str]] = None
+        self._default_limit = 0
+        if entries:
+            self._bulk_add(entries)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @property
+    def entries(self) -> dict[str, str]:
+        """name -> value (shared, read-only)."""
+        return self._values
+
+    def names_for(self, value: str) -> list[str]:
+        """Reverse lookup: every name mapped to ``value``."""
+        return sorted(self._names.get(value, ()))
+
+    def _link(self, name: str, value: str) -> None:
+        self._names.setdefault(value, set()).add(name)
+
+    def _unlink(self, name: str, value: str) -> None:
+        names = self._names.get(value)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._names[value]
+
+    @staticmethod
+    def _keys_for(name: str) -> list[tuple[str, int]]:
+        """Trie keys for ``name``: the whole name, then the suffix from each inner word."""
+        normalized = _normalize(name)
+        keys = [(normalized, 0)]
+        for word in _WORD.finditer(normalized):
+            if word.start() > 0:
+                keys.append((normalized[word.start():], 1))
+        return keys
+
+    def _bulk_add(self, entries: dict) -> None:
+        """Adds many new names with a single sort instead of one insort each."""
+        self._default = None
+        for name, value in entries.items():
+            self._values[name] = value
+            self._link(name, value)
+            for key, tier in self._keys_for(name):
+                self._keys.append((key, tier, name))
+            for trigram in _trigrams(_normalize(name)):
+                self._trigrams.setdefault(trigram, set()).add(name)
+        self._keys.sort()
+
+    def add(self, name: str, value: str) -> None:
+        self._default = None
+        previous = self._values.get(name)
+        if previous is not None:
+            self._unlink(name, previous)
+        self._link(name, value)
+        if previous is not None:
+            self._values[name] = value
+            return
+        self._values[name] = value
+        for key, tier in self._keys_for(name):
+            bisect.insort(self._keys, (key, tier, name))
+        for trigram in _trigrams(_normalize(name)):
+            self._trigrams.setdefault(trigram, set()).add(name)
+
+    def remove(self, name: str) -> None:
+        value = self._values.pop(name, None)
+        if value is None:
+            return
+        self._unlink(name, value)
+        self._default = None
+        for key, tier in self._keys_for(name):
+            entry = (key, tier, name)
+            i = bisect.bisect_left(self._keys, entry)
+            if i < len(self._keys) and self._keys[i] == entry:
+                del self._keys[i]
+        for trigram in _trigrams(_normalize(name)):
+            bucket = self._trigrams.get(trigram)
+            if bucket is not None:
+                bucket.discard(name)
+                if not bucket:
+                    del self._trigrams[trigram]
+        if self.popularity.pop(name, None):
+            self._popular = None
+        self.last_used.pop(name, None)
+
+    def rename(self, old: str, new: str) -> None:
+        value = self._values.get(old)
+        if value is None:
+            return
+        popularity, last_used = self.popularity.get(old, 0), self.last_used.get(old)
+        self.remove(old)
+        self.add(new, value)
+        self.set_usage(new, popularity, last_used)
+
+    def sync(self, entries: dict) -> None:
+        """Brings the index in line with ``entries``, touching only what changed."""
+        for name in [name for name in self._values if name not in entries]:
+            self.remove(name)
+        added = {}
+        for name, value in entries.items():
+            if name in self._values:
+                if self._values[name] != value:
+                    self.add(name, value)
+            else:
+                added[name] = value
+        if len(added) > 64:
+            # Ricaricamento completo del file: un solo sort
+            self._bulk_add(added)
+        else:
+            for name, value in added.items():
+                self.add(name, value)
+        self._default = None
+
+    def touch(self, name: str) -> None:
+        """Records a use of ``name`` (ranking by popularity and recency)."""
+        if name in self._values:
+            self.popularity[name] += 1
+            self.last_used[name] = time.time()
+            self._default = None
+            self._popular = None
+
+    def set_usage(self, name: str, count: int, last_used: Optional[float]) -> None:
+        """Restores the stored use count and last use of ``name``."""
+        if count:
+            self.popularity[name] = count
+            self._popular = None
+        if last_used is not None:
+            self.last_used[name] = last_used
+        self._default = None
+
+    def _rank(self, name: str, tier: int, similarity: float = 1.0) -> tuple:
+        return (
+            tier,
+            -similarity,
+            -self.popularity.get(name, 0),
+            -self.last_used.get(name, 0.0),
+            len(name),
+            name,
+        )
+
+    def _prefix(self, query: str) -> dict[str, int]:
+        found: dict[str, int] = {}
+        start = bisect.bisect_left(self._keys, (query,))
+        for key, tier, name in self._keys[start:start + MAX_PREFIX_CANDIDATES]:
+            if not key.startswith(query):
+                break
+            if tier < found.get(name, 2):
+                found[name] = tier
+        # Le voci più usate restano candidate anche oltre il limite del range
+        if self._popular is None:
+            self._popular = [
+                (name, self._keys_for(name))
+                for name in heapq.nlargest(MAX_POPULAR, self.popularity, key=self.popularity.__getitem__)
+            ]
+        for name, keys in self._popular:
+            if name not in found:
+                for key, tier in keys:
+                    if key.startswith(query):
+                        found[name] = tier
+                        break
+        return found
+
+    def _fuzzy(self, query: str, exclude: dict) -> list[tuple[str, float]]:
+        query_trigrams = sorted(
+            _trigrams(query), key=lambda trigram: len(self._trigrams.get(trigram, ()))
+        )
+        buckets = [self._trigrams.get(trigram, set()) for trigram in query_trigrams]
+        # Trigrammi in comune necessari per la soglia (nomi di almeno 3 trigrammi):
+        # un candidato valido compare per forza in uno dei bucket più rari
+        needed = max(1, math.ceil(MIN_SIMILARITY * (len(buckets) + 3) / (1 + MIN_SIMILARITY)))
+        candidates: set[str] = set()
+        for bucket in buckets[:len(buckets) - needed + 1]:
+            candidates.update(bucket)
+
+        matches = []
+        for name in candidates:
+            if name in exclude:
+                continue
+            shared = sum(1 for bucket in buckets if name in bucket)
+            name_trigrams = len(_normalize(name)) + 2
+            similarity = shared / (len(buckets) + name_trigrams - shared)
+            if similarity >= MIN_SIMILARITY:
+                matches.append((name, similarity))
+        return matches
+
+    def search(self, query: str, limit: int = 25) -> list[tuple[str, str]]:
+        """Best ``limit`` (name, value) pairs for ``query``."""
+        query = _normalize(query)
+        if not query:
+            if self._default is None or self._default_limit < limit:
+                self._default_limit = limit
+                self._default = heapq.nsmallest(
+                    limit, self._values, key=lambda name: self._rank(name, 0)
+                )
+            return [(name, self._values[name]) for name in self._default[:limit]]
+
+        candidates = {
+            name: self._rank(name, tier) for name, tier in self._prefix(query).items()
+        }
+        if len(candidates) < limit and len(query) >= 3:
+            for name, similarity in self._fuzzy(query, candidates):
+                candidates[name] = self._rank(name, 2, similarity)
+
+        ranked = sorted(candidates, key=candidates.__getitem__)
+        return [(name, self._values[name]) for name in ranked[:limit]]
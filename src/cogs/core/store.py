@@ -0,0 +1,350 @@
+"""SQLite store for per-guild metadata (speakers, aliases, soundboard sounds).
+
+One WAL-mode database (``data/metadata.db``) replaces the ``index.json`` /
+``alias.json`` files under every guild folder. All queries run on a single
+dedicated thread that owns the connection, so the event loop never blocks and
+writes from different cogs are serialized and atomic.
+
+The old JSON files are imported when the database is opened: each file is
+imported once, and again only if it is edited by hand (its mtime is recorded),
+so sounds added by editing ``soundboard/index.json`` still show up after a
+restart. The files are left in place as a backup.
+
+Autocomplete is served from memory: the entries of a (guild, kind) are loaded
+once into a ``SearchIndex`` and kept in step by the writes made here.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from cogs import BASE_DATA_DIR
+from cogs.core.search import SearchIndex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    guild_id    INTEGER NOT NULL,
+    kind        TEXT    NOT NULL,
+    name        TEXT    NOT NULL,
+    filename    TEXT    NOT NULL,
+    created_at  REAL    NOT NULL,
+    usage_count INTEGER NOT NULL DEFAULT 0,
+    last_used   REAL,
+    gain        REAL,
+    gain_key    TEXT,
+    PRIMARY KEY (guild_id, kind, name)
+);
+CREATE INDEX IF NOT EXISTS entries_by_filename ON entries (guild_id, kind, filename);
+CREATE INDEX IF NOT EXISTS entries_by_usage ON entries (kind, usage_count DESC);
+
+CREATE TABLE IF NOT EXISTS aliases (
+    guild_id INTEGER NOT NULL,
+    kind     TEXT    NOT NULL,
+    alias    TEXT    NOT NULL,
+    name     TEXT    NOT NULL,
+    PRIMARY KEY (guild_id, kind, alias)
+);
+
+CREATE TABLE IF NOT EXISTS imported (
+    path     TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+# Inserisce una voce o la punta a un nuovo file. Un file nuovo va rimisurato:
+# il guadagno salvato per il vecchio non vale più e viene azzerato
+UPSERT_ENTRY = """
+INSERT INTO entries (guild_id, kind, name, filename, created_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (guild_id, kind, name) DO UPDATE SET
+    filename = excluded.filename,
+    gain     = CASE WHEN filename = excluded.filename THEN gain END,
+    gain_key = CASE WHEN filename = excluded.filename THEN gain_key END
+"""
+
+# Colonne aggiunte dopo la prima versione dello schema
+MIGRATIONS = {
+    "gain": "ALTER TABLE entries ADD COLUMN gain REAL",
+    "gain_key": "ALTER TABLE entries ADD COLUMN gain_key TEXT",
+}
+
+# Tipi di voce -> cartella del server che conteneva l'indice JSON
+KINDS = {"speakers": "speakers", "soundboard": "soundboard"}
+
+
+class MetadataStore:
+    """Async front of the SQLite metadata database."""
+
+    def __init__(self, path: Path, json_root: Optional[Path] = None):
+        self.path = path
+        self.json_root = json_root
+        # Un solo thread: possiede la connessione e serializza le scritture
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metadata-db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._indexes: dict[tuple[int, str], SearchIndex] = {}
+
+    # --- Thread del database ---------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+            self._conn = conn
+            if self.json_root is not None:
+                self._import_json(conn, self.json_root)
+        return self._conn
+
+    async def _run(self, fn: Callable[..., Any], *args) -> Any:
+        def call():
+            conn = self._connect()
+            with conn:  # una transazione per chiamata: commit o rollback
+                return fn(conn, *args)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def close(self) -> None:
+        def shutdown():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        self._executor.submit(shutdown)
+        self._executor.shutdown(wait=True)
+
+    # --- Import dei vecchi JSON --------------------------------------------
+
+    @staticmethod
+    def _read_json(path: Path) -> dict:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Import saltato ({path}): {e}")
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _changed(self, conn: sqlite3.Connection, path: Path) -> Optional[int]:
+        """mtime of ``path`` if it was never imported or changed since, else None."""
+        mtime_ns = path.stat().st_mtime_ns
+        row = conn.execute("SELECT mtime_ns FROM imported WHERE path = ?", (str(path),)).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            return None
+        return mtime_ns
+
+    def _import_json(self, conn: sqlite3.Connection, root: Path) -> None:
+        imported = 0
+        with conn:
+            for guild_dir in root.iterdir():
+                if not guild_dir.is_dir() or not guild_dir.name.isdigit():
+                    continue
+                guild_id = int(guild_dir.name)
+                for kind, subfolder in KINDS.items():
+                    imported += self._import_file(conn, guild_id, kind, guild_dir / subfolder)
+
+            usage = root / "tts_usage.json"
+            if usage.exists() and (mtime_ns := self._changed(conn, usage)) is not None:
+                for key, count in self._read_json(usage).items():
+                    guild_id, _, filename = key.partition("/")
+                    conn.execute(
+                        "UPDATE entries SET usage_count = MAX(usage_count, ?) "
+                        "WHERE guild_id = ? AND kind = 'speakers' AND filename = ?",
+                        (int(count), int(guild_id), filename),
+                    )
+                self._mark(conn, usage, mtime_ns)
+        if imported:
+            print(f"[metadata] importate {imported} voci dai file JSON")
+
+    def _import_file(self, conn: sqlite3.Connection, guild_id: int, kind: str, folder: Path) -> int:
+        count = 0
+        index = folder / "index.json"
+        if index.exists() and (mtime_ns := self._changed(conn, index)) is not None:
+            for name, filename in self._read_json(index).items():
+                conn.execute(
+                    UPSERT_ENTRY, (guild_id, kind, name, filename, self._created_at(folder / filename))
+                )
+                count += 1
+            self._mark(conn, index, mtime_ns)
+
+        aliases = folder / "alias.json"
+        if aliases.exists() and (mtime_ns := self._changed(conn, aliases)) is not None:
+            conn.executemany(
+                "INSERT OR REPLACE INTO aliases (guild_id, kind, alias, name) VALUES (?, ?, ?, ?)",
+                [(guild_id, kind, alias, name) for alias, name in self._read_json(aliases).items()],
+            )
+            self._mark(conn, aliases, mtime_ns)
+        return count
+
+    @staticmethod
+    def _created_at(path: Path) -> float:
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return time.time()
+
+    @staticmethod
+    def _mark(conn: sqlite3.Connection, path: Path, mtime_ns: int) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO imported (path, mtime_ns) VALUES (?, ?)", (str(path), mtime_ns)
+        )
+
+    # --- Letture -----------------------------------------------------------
+
+    async def _index(self, guild_id: int, kind: str) -> SearchIndex:
+        key = (guild_id, kind)
+        index = self._indexes.get(key)
+        if index is None:
+            def build(conn: sqlite3.Connection) -> SearchIndex:
+                # Anche la costruzione dell'indice (secondi a 100k voci) resta fuori dal loop
+                rows = conn.execute(
+                    "SELECT name, filename, usage_count, last_used FROM entries "
+                    "WHERE guild_id = ? AND kind = ?",
+                    (guild_id, kind),
+                ).fetchall()
+                built = SearchIndex({name: filename for name, filename, _, _ in rows})
+                for name, _, usage_count, last_used in rows:
+                    built.set_usage(name, usage_count, last_used)
+                return built
+
+            built = await self._run(build)
+            index = self._indexes.setdefault(key, built)
+        return index
+
+    async def entries(self, guild_id: int, kind: str) -> dict[str, str]:
+        """name -> filename for a guild. The dict is shared: do not modify it."""
+        return (await self._index(guild_id, kind)).entries
+
+    async def search(self, guild_id: int, kind: str, query: str,
+                     limit: int = 25) -> list[tuple[str, str]]:
+        """Ranked (name, filename) matches for autocomplete."""
+        return (await self._index(guild_id, kind)).search(query, limit)
+
+    async def lookup_name(self, guild_id: int, kind: str, filename: str) -> Optional[str]:
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT name FROM entries WHERE guild_id = ? AND kind = ? AND filename = ?",
+                (guild_id, kind, filename),
+            ).fetchone()
+        )
+        return row[0] if row else None
+
+    async def resolve_alias(self, guild_id: int, kind: str, name: str) -> str:
+        """The current name for ``name`` if it was renamed, else ``name`` itself."""
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT name FROM aliases WHERE guild_id = ? AND kind = ? AND alias = ?",
+                (guild_id, kind, name),
+            ).fetchone()
+        )
+        return row[0] if row else name
+
+    async def top_used(self, kind: str, n: int) -> list[tuple[int, str]]:
+        """The ``n`` most used entries of ``kind`` across guilds, as (guild id, filename)."""
+        return await self._run(
+            lambda conn: conn.execute(
+                "SELECT guild_id, filename FROM entries WHERE kind = ? AND usage_count > 0 "
+                "ORDER BY usage_count DESC LIMIT ?",
+                (kind, n),
+            ).fetchall()
+        )
+
+    async def gain(self, guild_id: int, kind: str, filename: str, key: str) -> Optional[float]:
+        """
+        Stored playback gain (loudness normalization) of an entry, or None if
+        it was never measured or measured on a different ``key`` (e.g. the
+        file changed since).
+        """
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT gain FROM entries "
+                "WHERE guild_id = ? AND kind = ? AND filename = ? AND gain_key = ?",
+                (guild_id, kind, filename, key),
+            ).fetchone()
+        )
+        return row[0] if row else None
+
+    # --- Scritture ---------------------------------------------------------
+
+    async def add(self, guild_id: int, kind: str, name: str, filename: str) -> None:
+        """Adds ``name`` or points it at a new file (a new recording of the same voice)."""
+        await self._run(
+            lambda conn: conn.execute(UPSERT_ENTRY, (guild_id, kind, name, filename, time.time()))
+        )
+        index = self._indexes.get((guild_id, kind))
+        if index is not None:
+            index.add(name, filename)
+
+    async def rename(self, guild_id: int, kind: str, old: str, new: str) -> bool:
+        """Renames an entry and records ``old`` as an alias of ``new``."""
+        def rename(conn: sqlite3.Connection) -> bool:
+            # Come con i JSON: un nome già esistente viene sovrascritto
+            updated = conn.execute(
+                "UPDATE OR REPLACE entries SET name = ? WHERE guild_id = ? AND kind = ? AND name = ?",
+                (new, guild_id, kind, old),
+            ).rowcount
+            if not updated:
+                return False
+            conn.execute(
+                "UPDATE aliases SET name = ? WHERE guild_id = ? AND kind = ? AND name = ?",
+                (new, guild_id, kind, old),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO aliases (guild_id, kind, alias, name) VALUES (?, ?, ?, ?)",
+                (guild_id, kind, old, new),
+            )
+            return True
+
+        renamed = await self._run(rename)
+        index = self._indexes.get((guild_id, kind))
+        if renamed and index is not None:
+            index.remove(new)
+            index.rename(old, new)
+        return renamed
+
+    async def remove(self, guild_id: int, kind: str, name: str) -> None:
+        await self._run(
+            lambda conn: conn.execute(
+                "DELETE FROM entries WHERE guild_id = ? AND kind = ? AND name = ?",
+                (guild_id, kind, name),
+            )
+        )
+        index = self._indexes.get((guild_id, kind))
+        if index is not None:
+            index.remove(name)
+
+    async def set_gain(self, guild_id: int, kind: str, filename: str, gain: float,
+                       key: str) -> None:
+        await self._run(
+            lambda conn: conn.execute(
+                "UPDATE entries SET gain = ?, gain_key = ? "
+                "WHERE guild_id = ? AND kind = ? AND filename = ?",
+                (gain, key, guild_id, kind, filename),
+            )
+        )
+
+    async def record_use(self, guild_id: int, kind: str, filename: str) -> None:
+        """Counts a use of the entry (autocomplete ranking, TTS warm-up)."""
+        now = time.time()
+        await self._run(
+            lambda conn: conn.execute(
+                "UPDATE entries SET usage_count = usage_count + 1, last_used = ? "
+                "WHERE guild_id = ? AND kind = ? AND filename = ?",
+                (now, guild_id, kind, filename),
+            )
+        )
+        index = self._indexes.get((guild_id, kind))
+        if index is not None:
+            for name in index.names_for(filename):
+                index.touch(name)
+
+
+store = MetadataStore(BASE_DATA_DIR / "metadata.db", json_root=BASE_DATA_DIR)
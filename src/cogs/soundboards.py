@@ -4,12 +4,14 @@ import uuid
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
-from cogs import get_guild_dir, get_guild_json
+from cogs import BASE_DATA_DIR, get_guild_dir
+from cogs.audio import mixer
+from cogs.audio.loudness import analyze_file
+from cogs.audio.pcm_cache import MmapPCMSource, PCMCache
+from cogs.core import store
 import discord
-import torchaudio as ta
 from discord import app_commands
 from discord.ext import commands
-import json
 
 # -- Variabili Costanti --
 CURRDIR = Path(__file__).parent.absolute()
@@ -24,11 +26,67 @@ class Soundboards(commands.Cog) :
     '''
     def __init__(self, bot : commands.Bot) :
         self.bot = bot
+        # Suoni decodificati una volta sola in PCM e letti via mmap
+        self.pcm_cache = PCMCache()
+        # Misure di loudness in corso in background (gilda, sidecar)
+        self._measuring: set[tuple[int, Path]] = set()
+
+    async def cog_load(self) -> None:
+        self.bot.loop.create_task(self.prewarm_sounds())
+
+    async def prepare_sound(self, guild_id: int, path: Path,
+                            wait_gain: bool = True) -> tuple[Path, float]:
+        """
+        Sidecar PCM e guadagno di normalizzazione di un suono.
+        La prima volta decodifica e misura la loudness, poi è tutto in cache.
+        Con ``wait_gain=False`` un suono non ancora misurato suona a guadagno
+        unitario e la misura prosegue in background.
+        """
+        sidecar = await asyncio.to_thread(self.pcm_cache.ensure, path)
+        gain = await store.gain(guild_id, "soundboard", path.name, sidecar.name)
+        if gain is not None:
+            return sidecar, gain
+        if not wait_gain:
+            key = (guild_id, sidecar)
+            if key not in self._measuring:
+                self._measuring.add(key)
+                self.bot.loop.create_task(self.measure_gain(guild_id, path, sidecar))
+            return sidecar, 1.0
+        return sidecar, await self.measure_gain(guild_id, path, sidecar)
+
+    async def measure_gain(self, guild_id: int, path: Path, sidecar: Path) -> float:
+        try:
+            gain = await asyncio.to_thread(analyze_file, sidecar)
+            await store.set_gain(guild_id, "soundboard", path.name, gain, sidecar.name)
+            return gain
+        except Exception as e:
+            print(f"Misura loudness fallita ({path.name}): {e}")
+            return 1.0
+        finally:
+            self._measuring.discard((guild_id, sidecar))
+
+    async def prewarm_sounds(self) -> None:
+        """Decodifica e misura in background i suoni aggiunti dall'ultimo avvio."""
+        prepared = 0
+        for folder in BASE_DATA_DIR.glob("*/soundboard"):
+            if not folder.parent.name.isdigit():
+                continue
+            guild_id = int(folder.parent.name)
+            for filename in list((await store.entries(guild_id, "soundboard")).values()):
+                path = folder / filename
+                if not path.is_file():
+                    continue
+                try:
+                    if not self.pcm_cache.sidecar_path(path).exists():
+                        prepared += 1
+                    await self.prepare_sound(guild_id, path)
+                except Exception as e:
+                    print(f"Pre-decodifica saltata ({filename}): {e}")
+        if prepared:
+            print(f"🔊 Soundboard: {prepared} suoni pre-decodificati")
 
     async def oepn_sound_index(self, interaction : discord.Interaction) :
-        sound_index = await get_guild_json(interaction.guild_id, "soundboard")
-        with open(sound_index, "r", encoding="utf-8") as f :
-            return json.load(f)
+        return await store.entries(interaction.guild_id, "soundboard")
 
     async def vc_connect(self, interaction : discord.Interaction) :
         if not interaction.user.voice:
@@ -59,37 +117,44 @@ class Soundboards(commands.Cog) :
     async def sound_autocomplete(self,
                                  interaction : discord.Interaction,
                                  current : str) -> list[app_commands.Choice[str]]:
-        sounds = await self.oepn_sound_index(interaction)
-
-        return [app_commands.Choice(name=name, value=filename)
-            for name, filename in sounds.items()
-            if current.lower() in name.lower()][:25]
+        matches = await store.search(interaction.guild_id, "soundboard", current)
+        return [app_commands.Choice(name=name, value=filename) for name, filename in matches]
 
 
     @app_commands.command(name="soundboard", description="Riproduci un suono da una lista di suoni")
     @app_commands.describe(soundfile="Il souno che desideri venga riprodotto")
     @app_commands.autocomplete(soundfile=sound_autocomplete)
     async def connect(self,interaction : discord.Interaction,soundfile : str) :
-        sound_dir = await get_guild_dir(interaction.guild_id, "soundboards")
+        # Stessa cartella dell'indice (soundboard/)
+        sound_dir = await get_guild_dir(interaction.guild_id, "soundboard")
         soundfile = sound_dir / soundfile
+        if not soundfile.is_file():
+            await interaction.response.send_message("❌ Suono non trovato!", ephemeral=True)
+            return
 
         # Connettiti Alla vocale
-        await self.vc_connect(interaction)
+        if await self.vc_connect(interaction) == -1:
+            return
         vc = interaction.guild.voice_client
-            # Riproduci il suono..
-        if vc != -1 :
-            try :
-                if vc.is_playing() :
-                    vc.stop()
-            except Exception as e :
-                pass
-
-            try :
-                source = discord.FFmpegPCMAudio(soundfile)
-                vc.play(source)
-                await interaction.response.send_message(f"🔊|Suono Riprodotto")
-            except Exception as e :
-                print(f"Eccezzione : {e}")
+        if vc is None:
+            return
+        # Un suono mai riprodotto va prima decodificato: oltre i 3 s di Discord
+        if not interaction.response.is_done():
+            await interaction.response.defer()
+        await store.record_use(interaction.guild_id, "soundboard", soundfile.name)
+
+        # Riproduci il suono (decodificato alla prima richiesta, poi dalla cache)
+        try :
+            sidecar, gain = await self.prepare_sound(interaction.guild_id, soundfile, wait_gain=False)
+            source = MmapPCMSource(sidecar)
+        except Exception as e :
+            print(f"Eccezzione : {e}")
+            await interaction.followup.send("❌ Impossibile riprodurre il suono.")
+            return
+
+        # I suoni si sovrappongono a quello che sta già suonando
+        mixer.play(vc, source, kind="sfx", gain=gain)
+        await interaction.followup.send(f"🔊|Suono Riprodotto")
 
 
 
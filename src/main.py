@@ -1,11 +1,21 @@
 import discord
 import os
 import asyncio
+import hashlib
+import json
+import time
 from discord.ext import commands
 from dotenv import load_dotenv
+from cogs import BASE_DATA_DIR, IMPORT_TIMES
 
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+# Se impostato, i comandi vengono sincronizzati solo su questo server (sviluppo)
+DEV_GUILD_ID = os.getenv('DEV_GUILD_ID')
+# FORCE_SYNC=1 forza il sync anche se l'albero dei comandi non è cambiato
+FORCE_SYNC = os.getenv('FORCE_SYNC') == '1'
+# Hash dell'ultimo albero di comandi sincronizzato, per scope (global / guild:<id>)
+TREE_HASH_FILE = BASE_DATA_DIR / "command_tree.json"
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -19,22 +29,77 @@ class MyBot(commands.Bot):
             intents=intents,
             help_command=None
         )
+        self.load_times: dict[str, float] = {}
+
+    async def load_cog(self, name: str):
+        started = time.perf_counter()
+        await self.load_extension(f'cogs.{name}')
+        self.load_times[name] = (time.perf_counter() - started) * 1000
+        print(f'Caricato: {name}.py')
+
+    def print_import_report(self):
+        print("--- Tempi di caricamento (ms) ---")
+        for name, ms in sorted(self.load_times.items(), key=lambda item: -item[1]):
+            print(f"  {name:<28}{ms:>8.0f}")
+        # Gli import pesanti (torch, chatterbox, rvc...) avvengono in background:
+        # qui compaiono quelli già finiti, gli altri vengono stampati quando terminano
+        for module, ms in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+            print(f"  [lazy] {module:<21}{ms:>8.0f}")
+
+    def command_tree_hash(self, guild=None) -> str:
+        """Hash stabile dei comandi registrati (nomi, opzioni, scelte, descrizioni)."""
+        payload = [command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)]
+        payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    async def sync_commands(self):
+        """Sincronizza l'albero dei comandi solo se è cambiato dall'ultimo sync."""
+        guild = None
+        scope = "global"
+        if DEV_GUILD_ID:
+            guild = discord.Object(id=int(DEV_GUILD_ID))
+            self.tree.copy_global_to(guild=guild)
+            scope = f"guild:{DEV_GUILD_ID}"
+
+        try:
+            with open(TREE_HASH_FILE, "r", encoding="utf-8") as f:
+                synced_hashes = json.load(f)
+        except (OSError, ValueError):
+            synced_hashes = {}
+
+        current = self.command_tree_hash(guild)
+        if not FORCE_SYNC and synced_hashes.get(scope) == current:
+            print(f"Comandi invariati ({scope}), sync saltato.")
+            return
+
+        synced = await self.tree.sync(guild=guild)
+        print(f"Sincronizzati {len(synced)} comandi slash ({scope}).")
+        synced_hashes[scope] = current
+        TREE_HASH_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(TREE_HASH_FILE, "w", encoding="utf-8") as f:
+            json.dump(synced_hashes, f, indent=4)
 
     async def setup_hook(self):
-        # 1. Carica i Cogs
+        # 1. Carica i Cogs (uno alla volta: load_extension importa sul loop,
+        # ma gli import pesanti sono rimandati e il caricamento resta rapido)
         print("--- Caricamento Cogs ---")
-        for filename in os.listdir('./src/cogs'):
+        started = time.perf_counter()
+        for filename in sorted(os.listdir('./src/cogs')):
             if filename.endswith('.py'):
-                await self.load_extension(f'cogs.{filename[:-3]}')
-                print(f'Caricato: {filename}')
+                try:
+                    await self.load_cog(filename[:-3])
+                except Exception as e:
+                    print(f"Errore nel caricamento di {filename[:-3]}: {e}")
+        print(f"Cogs caricati in {(time.perf_counter() - started) * 1000:.0f} ms")
+        self.print_import_report()
 
         # 2. Sincronizza i comandi Slash (Tree Sync)
-        # NOTA: In produzione, evita di fare il sync globale ad ogni avvio per non essere limitato da Discord.
-        # Per ora, per testare, va bene qui.
+        # Il sync è limitato da Discord: si fa solo quando l'albero dei comandi cambia
+        # (DEV_GUILD_ID per il sync su un solo server, FORCE_SYNC=1 per forzarlo)
         print("--- Sincronizzazione Comandi ---")
         try:
-            synced = await self.tree.sync()
-            print(f"Sincronizzati {len(synced)} comandi slash.")
+            await self.sync_commands()
         except Exception as e:
             print(f"Errore nel sync: {e}")
 